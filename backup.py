@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Back up the recipe database while the app is running.
+
+Copies use SQLite's online backup API a few pages at a time, sleeping
+between steps, so a backup never holds the database for long and the app
+keeps saving recipes while it runs. Snapshots can instead be written with
+VACUUM INTO, which produces a compacted copy in one statement. Every copy
+is integrity-checked before it replaces anything, and snapshot() keeps only
+the newest few. BackupScheduler takes snapshots on a background thread at a
+fixed interval.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import db
+import metrics
+
+# Pages copied per backup step, and how long to pause between steps.
+DEFAULT_PAGES = 256
+DEFAULT_SLEEP = 0.01
+
+# A backup restarts whenever another connection writes to the database.
+# After this many restarts the rest is copied in one step, which in WAL mode
+# still does not block the writer.
+MAX_RESTARTS = 3
+
+class _Restarted(Exception):
+    pass
+
+def _connect(path):
+    return sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+
+def integrity_check(path=None, quick=False):
+    """Return the problems PRAGMA integrity_check finds in path (default: db.DB_FILE).
+
+    An empty list means the database is sound. quick=True runs the faster
+    quick_check, which skips verifying that indexes match their tables.
+    """
+    conn = _connect(path or db.DB_FILE)
+    try:
+        pragma = "quick_check" if quick else "integrity_check"
+        problems = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+    finally:
+        conn.close()
+    return [] if problems == ["ok"] else problems
+
+def _copy(source, dest, pages, sleep, progress):
+    restarts = 0
+    remaining_before = None
+
+    def on_step(status, remaining, total):
+        nonlocal restarts, remaining_before
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts >= MAX_RESTARTS:
+                raise _Restarted
+        remaining_before = remaining
+        if progress is not None:
+            progress(total - remaining, total)
+
+    try:
+        source.backup(dest, pages=pages, progress=on_step, sleep=sleep)
+    except _Restarted:
+        source.backup(dest, pages=-1)
+
+@metrics.timed("backup.backup_seconds")
+def backup(dest, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP, progress=None, check=True):
+    """Copy db.DB_FILE to dest with the online backup API and return dest.
+
+    The copy is written next to dest and only moved into place once it is
+    complete (and, with check=True, passes an integrity check), so dest is
+    never left half-written. progress(copied_pages, total_pages) is called
+    after each step.
+    """
+    partial = dest + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    source = _connect(db.DB_FILE)
+    try:
+        target = _connect(partial)
+        try:
+            _copy(source, target, pages, sleep, progress)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    _publish(partial, dest, check)
+    return dest
+
+@metrics.timed("backup.vacuum_into_seconds")
+def vacuum_into(dest, check=True):
+    """Write a compacted copy of db.DB_FILE to dest with VACUUM INTO and return dest."""
+    partial = dest + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    source = _connect(db.DB_FILE)
+    try:
+        source.execute("VACUUM INTO ?", (partial,))
+    finally:
+        source.close()
+    _publish(partial, dest, check)
+    return dest
+
+def _publish(partial, dest, check):
+    if check:
+        problems = integrity_check(partial)
+        if problems:
+            os.remove(partial)
+            raise sqlite3.DatabaseError(f"backup failed its integrity check: {problems[0]}")
+    os.replace(partial, dest)
+
+def _snapshot_prefix(directory):
+    stem = os.path.splitext(os.path.basename(db.DB_FILE))[0]
+    return os.path.join(directory, stem + "-")
+
+def list_snapshots(directory):
+    """Return the snapshots of db.DB_FILE in directory, oldest first."""
+    return sorted(glob.glob(glob.escape(_snapshot_prefix(directory)) + "[0-9]*-[0-9]*.db"))
+
+def snapshot(directory, keep=7, vacuum=False, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP):
+    """Write a timestamped copy of db.DB_FILE into directory and return its path.
+
+    Snapshots beyond the newest `keep` are deleted afterwards. vacuum=True
+    writes the copy with VACUUM INTO instead of the paged backup.
+    """
+    os.makedirs(directory, exist_ok=True)
+    dest = _snapshot_prefix(directory) + time.strftime("%Y%m%d-%H%M%S") + ".db"
+    if vacuum:
+        vacuum_into(dest)
+    else:
+        backup(dest, pages, sleep)
+    if keep:
+        for old in list_snapshots(directory)[:-keep]:
+            os.remove(old)
+    return dest
+
+class BackupScheduler:
+    """Take a snapshot every `interval` seconds on a background thread.
+
+    on_done(path, error) is called from the backup thread after each
+    attempt; error is None on success. A failed snapshot is retried at the
+    next interval rather than stopping the schedule.
+    """
+
+    def __init__(self, directory, interval=3600, keep=7, vacuum=False, on_done=None):
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.vacuum = vacuum
+        self.on_done = on_done
+        self.last_snapshot = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="backup", daemon=True)
+            self._thread.start()
+        return self
+
+    def run_now(self):
+        """Take a snapshot as soon as possible instead of waiting out the interval."""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stop the schedule, waiting up to timeout seconds for a running snapshot."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                path = snapshot(self.directory, self.keep, self.vacuum)
+            except (sqlite3.Error, OSError) as e:
+                metrics.inc("backup.failures")
+                path, error = None, e
+            else:
+                self.last_snapshot, error = path, None
+            if self.on_done is not None:
+                self.on_done(path, error)
+
+def _print_progress(copied, total):
+    print(f"\rcopied {copied}/{total} pages", end="", file=sys.stderr)
+    if copied == total:
+        print(file=sys.stderr)
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default=db.DB_FILE,
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup_parser = commands.add_parser("backup", parents=[common], help="copy the database to a file")
+    backup_parser.add_argument("dest")
+    backup_parser.add_argument("--vacuum", action="store_true", help="write a compacted copy with VACUUM INTO")
+    backup_parser.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="pages copied per step")
+    snapshot_parser = commands.add_parser("snapshot", parents=[common],
+                                          help="write a timestamped copy to a directory, keeping the newest")
+    schedule_parser = commands.add_parser("schedule", parents=[common],
+                                          help="take snapshots at a fixed interval until interrupted")
+    for sub in (snapshot_parser, schedule_parser):
+        sub.add_argument("--dir", default="backups", help="snapshot directory (default: backups)")
+        sub.add_argument("--keep", type=int, default=7, help="snapshots to keep (0 keeps all)")
+        sub.add_argument("--vacuum", action="store_true", help="write snapshots with VACUUM INTO")
+    schedule_parser.add_argument("--interval", type=float, default=3600, help="seconds between snapshots")
+    check_parser = commands.add_parser("check", parents=[common], help="run an integrity check")
+    check_parser.add_argument("path", nargs="?", help="database to check (default: --db)")
+    check_parser.add_argument("--quick", action="store_true", help="run the faster quick_check")
+    args = parser.parse_args(argv)
+
+    db.DB_FILE = args.db
+    if not os.path.exists(db.DB_FILE):
+        print(f"{db.DB_FILE} does not exist", file=sys.stderr)
+        return 1
+    try:
+        if args.command == "backup":
+            if args.vacuum:
+                vacuum_into(args.dest)
+            else:
+                backup(args.dest, args.pages, progress=_print_progress)
+            print(args.dest)
+        elif args.command == "snapshot":
+            print(snapshot(args.dir, args.keep, args.vacuum))
+        elif args.command == "schedule":
+            def report(path, error):
+                print(path if error is None else f"snapshot failed: {error}", file=sys.stderr)
+            scheduler = BackupScheduler(args.dir, args.interval, args.keep, args.vacuum, report).start()
+            scheduler.run_now()
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                scheduler.stop()
+        else:
+            problems = integrity_check(args.path, args.quick)
+            for problem in problems:
+                print(problem)
+            print("ok" if not problems else f"{len(problems)} problems found", file=sys.stderr)
+            return 1 if problems else 0
+    except sqlite3.Error as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
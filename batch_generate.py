@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Generate recipes for many prompts without the GUI.
+
+Prompts are read one per line from a file (or stdin), generated
+concurrently under request and token rate limits, and saved to the
+recipe database in batches. Progress is appended to a checkpoint file so
+an interrupted run can be restarted and will skip finished prompts.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import openai
+
+import db
+import openai_integration
+
+# Errors worth retrying: throttling, timeouts, dropped connections and 5xx.
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+)
+
+class RateLimiter:
+    """Token-bucket limiter for requests per minute and tokens per minute."""
+
+    def __init__(self, requests_per_min, tokens_per_min):
+        self.rpm = requests_per_min
+        self.tpm = tokens_per_min
+        self._requests = float(requests_per_min)
+        self._tokens = float(tokens_per_min)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens):
+        """Block until one request and the given number of tokens are available."""
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60.0 / self.rpm,
+                    (tokens - self._tokens) * 60.0 / self.tpm,
+                )
+            time.sleep(max(wait, 0.01))
+
+    def adjust(self, estimated, actual):
+        """Correct the token bucket once the real usage of a request is known."""
+        with self._lock:
+            self._tokens = min(self.tpm, self._tokens + estimated - actual)
+
+def _is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    status = getattr(error, "http_status", None)
+    return isinstance(error, openai.error.APIError) and (status is None or status >= 500)
+
+def _retry_after(error):
+    """Return the server's Retry-After delay in seconds, if it sent one."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def generate_one(prompt, limiter, max_retries, timeout, use_cache):
+    """Generate a recipe for prompt, retrying transient API failures with backoff.
+
+    Returns the (formatted_text, recipe_data) pair from parse_recipe.
+    """
+    if use_cache:
+        cached = openai_integration.cached_reply(prompt)
+        if cached is not None:
+            return openai_integration.parse_recipe(cached)
+    # Reserve the worst case up front (prompt estimate plus the reply cap).
+    estimated = len(prompt) // 4 + len(openai_integration.SYSTEM_MESSAGE) // 4 + openai_integration.MAX_TOKENS
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated)
+        try:
+            raw_text, used = openai_integration.complete(prompt, timeout=timeout)
+        except Exception as e:
+            limiter.adjust(estimated, 0)
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            delay = _retry_after(e) or min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(delay)
+            continue
+        limiter.adjust(estimated, used)
+        formatted_text, recipe_data = openai_integration.parse_recipe(raw_text)
+        openai_integration.remember_reply(prompt, raw_text, recipe_data)
+        return formatted_text, recipe_data
+
+def _prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+def load_checkpoint(path):
+    """Return {index: prompt_hash} for prompts already saved by an earlier run."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A partially written last line from a crash.
+            done[entry["index"]] = entry["hash"]
+    return done
+
+def _row(recipe_data, formatted_text):
+    try:
+        calories = int(recipe_data.get("calories", 0))
+    except (TypeError, ValueError):
+        calories = 0
+    return (
+        recipe_data.get("name") or "Unnamed Recipe",
+        recipe_data.get("ingredients", ""),
+        formatted_text,
+        calories,
+    )
+
+def run(prompts, checkpoint_path, concurrency=4, requests_per_min=60, tokens_per_min=40000,
+        batch_size=50, max_retries=5, timeout=90, use_cache=True, log=sys.stderr):
+    """Generate and save recipes for prompts; return (saved, failed, skipped) counts."""
+    done = load_checkpoint(checkpoint_path)
+    todo = [(i, p) for i, p in enumerate(prompts) if done.get(i) != _prompt_hash(p)]
+    skipped = len(prompts) - len(todo)
+    limiter = RateLimiter(requests_per_min, tokens_per_min)
+    saved = failed = 0
+    batch = []
+
+    def flush(checkpoint):
+        nonlocal saved
+        if not batch:
+            return
+        db.save_recipes(row for _, row in batch)
+        # Only record prompts once their recipes are committed.
+        for index, _ in batch:
+            checkpoint.write(json.dumps({"index": index, "hash": _prompt_hash(prompts[index])}) + "\n")
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+        saved += len(batch)
+        batch.clear()
+        print(f"saved {saved + skipped}/{len(prompts)} ({failed} failed)", file=log)
+
+    with open(checkpoint_path, "a") as checkpoint, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(generate_one, prompt, limiter, max_retries, timeout, use_cache): index
+            for index, prompt in todo
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                formatted_text, recipe_data = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"prompt {index + 1} failed: {e}", file=log)
+                continue
+            if recipe_data is None:
+                failed += 1
+                print(f"prompt {index + 1} did not return valid recipe JSON", file=log)
+                continue
+            batch.append((index, _row(recipe_data, formatted_text)))
+            if len(batch) >= batch_size:
+                flush(checkpoint)
+        flush(checkpoint)
+    return saved, failed, skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("prompts", nargs="?", default="-",
+                        help="file with one prompt per line (default: stdin)")
+    parser.add_argument("--checkpoint", help="progress file (default: <prompts>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=60, help="max requests per minute")
+    parser.add_argument("--tpm", type=int, default=40000, help="max tokens per minute")
+    parser.add_argument("--batch-size", type=int, default=50, help="recipes per database transaction")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=90, help="per-request timeout in seconds")
+    parser.add_argument("--no-cache", action="store_true", help="always request new recipes")
+    parser.add_argument("--db", help="recipe database file (default: %s)" % db.DB_FILE)
+    parser.add_argument("--api-base", help="OpenAI-compatible base URL, e.g. a fake_openai_server.py instance")
+    args = parser.parse_args(argv)
+
+    if args.prompts == "-":
+        lines = sys.stdin.read().splitlines()
+        checkpoint = args.checkpoint or "stdin.checkpoint"
+    else:
+        with open(args.prompts) as f:
+            lines = f.read().splitlines()
+        checkpoint = args.checkpoint or args.prompts + ".checkpoint"
+    prompts = [line.strip() for line in lines if line.strip()]
+
+    if args.db:
+        db.DB_FILE = args.db
+    openai_integration.configure(api_base=args.api_base)
+    db.init_db()
+    try:
+        saved, failed, skipped = run(
+            prompts, checkpoint,
+            concurrency=args.concurrency,
+            requests_per_min=args.rpm,
+            tokens_per_min=args.tpm,
+            batch_size=args.batch_size,
+            max_retries=args.max_retries,
+            timeout=args.timeout,
+            use_cache=not args.no_cache,
+        )
+    finally:
+        openai_integration.client.close()
+        db.close_db()
+    print(f"done: {saved} saved, {failed} failed, {skipped} already done", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
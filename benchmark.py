@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Benchmark the database, formatting and generation hot paths.
+
+Each run synthesizes recipe databases of the requested sizes in a
+temporary directory and measures search latency for typed keystroke
+sequences, insert/delete throughput and format_recipe throughput, then
+times generation round trips against a local fake OpenAI endpoint.
+Results are written as JSON and can be compared with a stored baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import db
+from fake_openai_server import FakeOpenAIServer
+from utils import format_recipe
+
+WORDS = [
+    "chicken", "beef", "pork", "tofu", "salmon", "shrimp", "lentil", "chickpea",
+    "tomato", "onion", "garlic", "ginger", "pepper", "spinach", "kale", "rice",
+    "noodle", "potato", "carrot", "mushroom", "cheese", "butter", "cream",
+    "basil", "cilantro", "lemon", "lime", "coconut", "curry", "chili", "bean",
+    "corn", "egg", "flour", "honey", "soy", "sesame", "yogurt", "avocado",
+]
+DISHES = ["curry", "stew", "salad", "soup", "tacos", "pasta", "stir fry", "bowl", "bake", "chili"]
+KEYSTROKE_QUERIES = ["chicken", "vegan chili", "beef stew", "lemon", "coconut curry"]
+
+# Query shapes whose plans must come from the indexes added for them.
+PLAN_EXPECTATIONS = [
+    ({"min_cal": 300, "max_cal": 400}, "USING COVERING INDEX idx_recipes_calories"),
+    ({"order_by": "name"}, "USING COVERING INDEX idx_recipes_name"),
+    ({"order_by": "calories"}, "USING COVERING INDEX idx_recipes_calories"),
+    ({"search_text": "chicken"}, "VIRTUAL TABLE INDEX"),
+]
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def latency_summary(samples):
+    """Return p50/p99/mean in milliseconds for a list of durations in seconds."""
+    return {
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "samples": len(samples),
+    }
+
+def synthetic_recipe(rng):
+    ingredients = rng.sample(WORDS, rng.randint(4, 9))
+    name = f"{rng.choice(ingredients).title()} {rng.choice(DISHES).title()}"
+    steps = " ".join(
+        f"{i}. {rng.choice(['Chop', 'Simmer', 'Stir', 'Bake', 'Season'])} the {rng.choice(ingredients)}."
+        for i in range(1, rng.randint(4, 10))
+    )
+    quantities = [f"{rng.randint(1, 4)} cups {item}" for item in ingredients]
+    return name, ", ".join(quantities), steps, rng.randint(80, 1400)
+
+def build_database(path, rows, seed=0, batch=10000):
+    """Create a database at path holding rows synthetic recipes."""
+    rng = random.Random(seed)
+    db.DB_FILE = path
+    db.init_db()
+    remaining = rows
+    while remaining:
+        count = min(batch, remaining)
+        db.save_recipes(synthetic_recipe(rng) for _ in range(count))
+        remaining -= count
+    with db.get_connections().write() as conn:
+        conn.execute("ANALYZE")
+
+def bench_search(repeats):
+    """Time a first-page query for every prefix of each keystroke query."""
+    page_samples = []
+    full_samples = []
+    for _ in range(repeats):
+        for query in KEYSTROKE_QUERIES:
+            for end in range(1, len(query) + 1):
+                prefix = query[:end]
+                started = time.perf_counter()
+                db.load_recipe_page(prefix, limit=200)
+                page_samples.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                db.load_recipes(prefix, max_cal=800)
+                full_samples.append(time.perf_counter() - started)
+    return {"first_page": latency_summary(page_samples), "load_recipes": latency_summary(full_samples)}
+
+def bench_writes(count, seed=1):
+    """Measure insert and delete throughput, one at a time and batched."""
+    rng = random.Random(seed)
+    results = {}
+
+    rows = [synthetic_recipe(rng) for _ in range(count)]
+    started = time.perf_counter()
+    ids = [db.save_recipe(*row) for row in rows]
+    results["save_recipe_per_sec"] = count / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for recipe_id in ids:
+        db.delete_recipe(recipe_id)
+    results["delete_recipe_per_sec"] = count / (time.perf_counter() - started)
+
+    rows = [synthetic_recipe(rng) for _ in range(count * 10)]
+    started = time.perf_counter()
+    db.save_recipes(rows)
+    results["save_recipes_per_sec"] = len(rows) / (time.perf_counter() - started)
+
+    with db.get_connections().read() as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM recipes ORDER BY id DESC LIMIT ?", (len(rows),))]
+    started = time.perf_counter()
+    db.delete_recipes(ids)
+    results["delete_recipes_per_sec"] = len(ids) / (time.perf_counter() - started)
+    return results
+
+def check_query_plans():
+    """Return EXPLAIN QUERY PLAN results and whether each used its index."""
+    checks = []
+    for filters, expected in PLAN_EXPECTATIONS:
+        query, params = db._recipe_query(("id", "name", "calories"), **filters)
+        with db.get_connections().read() as conn:
+            plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        checks.append({
+            "filters": filters,
+            "expected": expected,
+            "plan": plan,
+            "ok": any(expected in step for step in plan),
+        })
+    return checks
+
+def bench_format(count, seed=2):
+    rng = random.Random(seed)
+    recipes = []
+    for _ in range(count):
+        name, ingredients, recipe_text, calories = synthetic_recipe(rng)
+        recipes.append({"name": name, "ingredients": ingredients,
+                        "recipe_text": recipe_text, "calories": calories})
+    started = time.perf_counter()
+    for recipe in recipes:
+        format_recipe(recipe)
+    return {"format_recipe_per_sec": count / (time.perf_counter() - started)}
+
+def bench_generation(requests, latency):
+    """Time request_recipe and stream_recipe against a local fake endpoint."""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    try:
+        import openai
+        import openai_integration
+    except ImportError as e:
+        return {"skipped": str(e)}
+    openai_integration.preload()
+    previous_base = openai.api_base
+    with FakeOpenAIServer(latency=latency, seed=0) as server:
+        openai_integration.configure(api_base=server.url)
+        try:
+            round_trips = []
+            for i in range(requests):
+                started = time.perf_counter()
+                openai_integration.request_recipe(f"benchmark prompt {i}", use_cache=False)
+                round_trips.append(time.perf_counter() - started)
+            first_text = []
+            streamed = []
+            for i in range(requests):
+                started = time.perf_counter()
+                arrivals = []
+                openai_integration.stream_recipe(
+                    f"benchmark stream {i}",
+                    lambda text: arrivals.append(time.perf_counter()) if not arrivals else None,
+                    use_cache=False)
+                streamed.append(time.perf_counter() - started)
+                if arrivals:
+                    first_text.append(arrivals[0] - started)
+        finally:
+            openai_integration.configure(api_base=previous_base)
+    results = {
+        "server_latency": latency,
+        "round_trip": latency_summary(round_trips),
+        "stream_total": latency_summary(streamed),
+    }
+    if first_text:
+        results["stream_first_text"] = latency_summary(first_text)
+    return results
+
+def run(sizes, repeats, write_count, format_count, generation_requests, generation_latency):
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+        },
+        "databases": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, f"recipes-{size}.db")
+            started = time.perf_counter()
+            build_database(path, size)
+            build_seconds = time.perf_counter() - started
+            print(f"built {size} rows in {build_seconds:.1f}s", file=sys.stderr)
+            entry = {"build_seconds": build_seconds}
+            entry["search"] = bench_search(repeats)
+            entry["writes"] = bench_writes(write_count)
+            entry["query_plans"] = check_query_plans()
+            results["databases"][str(size)] = entry
+            db.close_db()
+        results["format"] = bench_format(format_count)
+        if generation_requests:
+            # Generation caches replies in the database, so give it one.
+            db.DB_FILE = os.path.join(tmp, "generation.db")
+            db.init_db()
+            results["generation"] = bench_generation(generation_requests, generation_latency)
+            db.close_db()
+    return results
+
+def _flatten(results, prefix=""):
+    """Yield (dotted.name, value) for every numeric leaf in results."""
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+def compare(results, baseline, tolerance):
+    """Return regressions of more than tolerance (a fraction) against baseline.
+
+    Latencies (*_ms) regress when they grow; throughputs (*_per_sec) when
+    they shrink. Other figures are informational only.
+    """
+    current = dict(_flatten(results))
+    regressions = []
+    for name, old in _flatten(baseline):
+        new = current.get(name)
+        if new is None or not old:
+            continue
+        if name.endswith("_ms"):
+            change = (new - old) / old
+        elif name.endswith("_per_sec"):
+            change = (old - new) / old
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({"metric": name, "baseline": old, "current": new,
+                                "regression": round(change, 3)})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated database sizes (e.g. 1000,10000,100000,1000000)")
+    parser.add_argument("--repeats", type=int, default=5, help="passes over the keystroke queries")
+    parser.add_argument("--writes", type=int, default=200, help="rows for the one-at-a-time write tests")
+    parser.add_argument("--format-count", type=int, default=20000)
+    parser.add_argument("--generation-requests", type=int, default=50, help="0 skips generation")
+    parser.add_argument("--generation-latency", default="fixed:0.05",
+                        help="fake server latency distribution (see fake_openai_server.py)")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--baseline", help="compare against results from an earlier run")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    results = run(sizes, args.repeats, args.writes, args.format_count,
+                  args.generation_requests, args.generation_latency)
+
+    failed = False
+    bad_plans = [check for entry in results["databases"].values()
+                 for check in entry["query_plans"] if not check["ok"]]
+    if bad_plans:
+        failed = True
+        print(f"{len(bad_plans)} query plan(s) no longer use their index", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(results, json.load(f), args.tolerance)
+        for regression in results["regressions"]:
+            failed = True
+            print(f"regression: {regression['metric']} {regression['baseline']:.3f} -> "
+                  f"{regression['current']:.3f}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(output + "\n")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Compress the recipe bodies of an existing database and report the savings.
+
+The chosen codec (zlib or zstd, optionally with a dictionary trained on the
+database's own recipes) becomes the storage mode for new recipes too; pass
+--codec plain to go back to uncompressed text. Size and read latency are
+measured before and after and printed as JSON. With --dry-run the work is
+done on a temporary copy, so the database itself is left untouched.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import compression
+import db
+from benchmark import latency_summary
+
+def measure(samples, seed=0):
+    """Return size figures and get_recipe_text latency for the current database."""
+    with db.get_connections().read() as conn:
+        (rows, body_bytes) = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(recipe_text AS BLOB))), 0) FROM recipes"
+        ).fetchone()
+        (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+        (page_count,) = conn.execute("PRAGMA page_count").fetchone()
+        (free_pages,) = conn.execute("PRAGMA freelist_count").fetchone()
+        ids = [row[0] for row in conn.execute("SELECT id FROM recipes")]
+    result = {
+        "rows": rows,
+        "body_bytes": body_bytes,
+        "db_bytes": (page_count - free_pages) * page_size,
+    }
+    if ids:
+        rng = random.Random(seed)
+        latencies = []
+        for recipe_id in rng.choices(ids, k=samples):
+            started = time.perf_counter()
+            db.get_recipe_text(recipe_id)
+            latencies.append(time.perf_counter() - started)
+        result["read"] = latency_summary(latencies)
+    return result
+
+def sample_bodies(count, seed=0):
+    """Return the text of up to count randomly chosen recipes."""
+    with db.get_connections().read() as conn:
+        ids = [row[0] for row in conn.execute("SELECT id FROM recipes")]
+    chosen = random.Random(seed).sample(ids, min(count, len(ids)))
+    return [text for text in db.get_recipe_texts(chosen).values() if text]
+
+def vacuum(path):
+    """Checkpoint the WAL and VACUUM so the file shrinks to its live pages."""
+    db.close_db()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+def compact(path, codec, level, dictionary_size, samples, batch_size, read_samples, run_vacuum):
+    db.DB_FILE = path
+    db.init_db()
+    before = measure(read_samples)
+
+    dictionary = None
+    if codec != "plain" and dictionary_size:
+        bodies = sample_bodies(samples)
+        try:
+            dictionary = compression.train_dictionary(codec, bodies, dictionary_size) or None
+        except Exception as e:
+            # zstd refuses to train on too few samples; compress without one.
+            print(f"no dictionary trained: {e}", file=sys.stderr)
+
+    started = time.perf_counter()
+    db.set_body_codec(codec, level, dictionary)
+    rewritten = db.recompress_bodies(
+        batch_size, progress=lambda n: print(f"rewrote {n} rows", file=sys.stderr))
+    elapsed = time.perf_counter() - started
+    if run_vacuum:
+        vacuum(path)
+
+    after = measure(read_samples)
+    db.close_db()
+    return {
+        "codec": codec,
+        "level": compression.DEFAULT_LEVELS.get(codec) if level is None else level,
+        "dictionary_bytes": len(dictionary) if dictionary else 0,
+        "rows_rewritten": rewritten,
+        "rewrite_seconds": elapsed,
+        "file_bytes": os.path.getsize(path),
+        "before": before,
+        "after": after,
+        "body_ratio": after["body_bytes"] / before["body_bytes"] if before["body_bytes"] else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", nargs="?", default=db.DB_FILE)
+    parser.add_argument("--codec", choices=compression.METHODS, default="zlib")
+    parser.add_argument("--level", type=int, help="compression level (default: 9)")
+    parser.add_argument("--dictionary-size", type=int, default=16 * 1024,
+                        help="bytes of shared dictionary to train (0 for none)")
+    parser.add_argument("--samples", type=int, default=2000,
+                        help="recipes to train the dictionary on")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows rewritten per transaction")
+    parser.add_argument("--read-samples", type=int, default=1000,
+                        help="get_recipe_text calls timed before and after")
+    parser.add_argument("--no-vacuum", action="store_true", help="skip the final VACUUM")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="compact a temporary copy and only report the results")
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        parser.error(f"no such database: {args.database}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.database
+        if args.dry_run:
+            path = os.path.join(tmp, os.path.basename(args.database))
+            source = sqlite3.connect(args.database)
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+        report = compact(path, args.codec, args.level, args.dictionary_size, args.samples,
+                         args.batch_size, args.read_samples, not args.no_vacuum)
+    report["dry_run"] = args.dry_run
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
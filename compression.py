@@ -0,0 +1,126 @@
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional; zlib is always available.
+    zstandard = None
+
+# Compressed bodies are stored as BLOBs starting with MAGIC and the ID of the
+# body_codecs row that wrote them. Plain TEXT values are passed through, so
+# a database can mix compressed and uncompressed rows.
+MAGIC = b"RB"
+_HEADER = struct.Struct(">2sI")
+
+METHODS = ("plain", "zlib", "zstd")
+DEFAULT_LEVELS = {"zlib": 9, "zstd": 9}
+
+# zlib preset dictionaries only use the last 32 KiB.
+ZLIB_MAX_DICTIONARY = 32 * 1024
+
+# Line and sentence boundaries, used to find repeated phrases for zlib.
+_FRAGMENT_BREAK = re.compile(r"\n|(?<=[.!?:])\s+")
+
+class Codec:
+    """Encode and decode recipe bodies for one row of the body_codecs table."""
+
+    def __init__(self, codec_id, method, level=None, dictionary=None):
+        if method not in METHODS:
+            raise ValueError(f"unknown compression method: {method!r}")
+        if method == "zstd" and zstandard is None:
+            raise RuntimeError("the zstandard package is required for zstd compression")
+        self.id = codec_id
+        self.method = method
+        self.level = DEFAULT_LEVELS.get(method) if level is None else level
+        self.dictionary = dictionary
+        self._header = _HEADER.pack(MAGIC, codec_id)
+        self._local = threading.local()
+        if method == "zstd" and dictionary:
+            self._zstd_dict = zstandard.ZstdCompressionDict(dictionary)
+        else:
+            self._zstd_dict = None
+
+    def encode(self, text):
+        """Return text as stored by this codec: unchanged for plain, else a BLOB."""
+        if self.method == "plain" or text is None:
+            return text
+        data = text.encode("utf-8")
+        if self.method == "zlib":
+            if self.dictionary:
+                compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+            else:
+                compressor = zlib.compressobj(self.level)
+            payload = compressor.compress(data) + compressor.flush()
+        else:
+            payload = self._zstd().compress(data)
+        return self._header + payload
+
+    def decode(self, payload):
+        """Return the text for a payload written by encode (header stripped)."""
+        if self.method == "zlib":
+            if self.dictionary:
+                decompressor = zlib.decompressobj(zdict=self.dictionary)
+            else:
+                decompressor = zlib.decompressobj()
+            data = decompressor.decompress(payload) + decompressor.flush()
+        else:
+            data = self._zstd(decompress=True).decompress(payload)
+        return data.decode("utf-8")
+
+    def _zstd(self, decompress=False):
+        # zstandard (de)compressor objects must not be shared between threads.
+        attr = "decompressor" if decompress else "compressor"
+        obj = getattr(self._local, attr, None)
+        if obj is None:
+            if decompress:
+                obj = zstandard.ZstdDecompressor(dict_data=self._zstd_dict)
+            else:
+                obj = zstandard.ZstdCompressor(level=self.level, dict_data=self._zstd_dict)
+            setattr(self._local, attr, obj)
+        return obj
+
+def codec_id(value):
+    """Return the codec ID a stored value was written with, or None for plain text."""
+    if isinstance(value, bytes) and value[:len(MAGIC)] == MAGIC:
+        return _HEADER.unpack_from(value)[1]
+    return None
+
+def decode(value, codecs):
+    """Return the text of a stored body, looking up its codec in codecs by ID."""
+    cid = codec_id(value)
+    if cid is None:
+        return value
+    return codecs[cid].decode(value[_HEADER.size:])
+
+def train_dictionary(method, samples, size):
+    """Build a shared dictionary of at most size bytes from sample texts.
+
+    zstd dictionaries come from zstandard's trainer. zlib has no trainer, so
+    its preset dictionary is made of the most common lines and sentences,
+    with the most frequent last where zlib finds matches cheapest.
+    """
+    if method == "zstd":
+        if zstandard is None:
+            raise RuntimeError("the zstandard package is required for zstd compression")
+        encoded = [text.encode("utf-8") for text in samples]
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    if method == "zlib":
+        size = min(size, ZLIB_MAX_DICTIONARY)
+        counts = Counter(fragment.strip() for text in samples
+                         for fragment in _FRAGMENT_BREAK.split(text))
+        counts.pop("", None)
+        chosen = []
+        used = 0
+        for fragment, count in counts.most_common():
+            if count < 2:
+                break
+            data = fragment.encode("utf-8") + b"\n"
+            if used + len(data) > size:
+                break
+            chosen.append(data)
+            used += len(data)
+        return b"".join(reversed(chosen))
+    return None
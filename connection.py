@@ -0,0 +1,128 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class ConnectionManager:
+    """Own the SQLite connections for one database file.
+
+    Writes are serialized through a single long-lived writer connection.
+    Reads check out one of a small pool of reader connections, which WAL
+    mode lets run concurrently with the writer. Connections are opened once
+    and reused, so callers no longer pay connect/teardown per query.
+
+    on_connect, if given, is called with each new connection (e.g. to
+    register SQL functions).
+    """
+
+    def __init__(self, path, max_readers=4, synchronous="NORMAL",
+                 mmap_size=256 * 1024 * 1024, cached_statements=256, busy_timeout=5.0,
+                 on_connect=None):
+        self.path = path
+        self.max_readers = max_readers
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.on_connect = on_connect
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._idle_readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._readers_lock = threading.Lock()
+        self._all_readers = []
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self, readonly):
+        """Open and tune a new connection."""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # Transactions are managed explicitly in write().
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    @contextmanager
+    def write(self):
+        """Yield the writer connection inside an immediate transaction.
+
+        The transaction commits when the block exits normally and rolls back
+        if it raises. Nested write() calls join the outer transaction.
+        """
+        with self._write_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("connection manager is closed")
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            conn = self._writer
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    @contextmanager
+    def read(self):
+        """Yield a reader connection for the calling thread.
+
+        A thread that already holds a reader reuses it, so nested reads never
+        wait on the pool. Reads always use a reader connection, even inside
+        write(), so they see committed data only.
+        """
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._checkout_reader()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._idle_readers.put(conn)
+
+    def _checkout_reader(self):
+        """Take an idle reader, opening a new one while under the pool limit."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("connection manager is closed")
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                conn = self._connect(readonly=True)
+                self._all_readers.append(conn)
+                return conn
+        return self._idle_readers.get()
+
+    def close(self):
+        """Close every connection owned by this manager."""
+        with self._write_lock:
+            self._closed = True
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+            self._reader_count = 0
@@ -1,54 +1,850 @@
+import os
+import re
 import sqlite3
+import threading
+import time
 
-DB_FILE = "recipes.db"
+import compression
+import metrics
+import minhash
+from connection import ConnectionManager
+from utils import normalize_ingredient, parse_ingredient, split_ingredients
+
+# Database path. RECIPE_DB (or main.py --db) can point it elsewhere, e.g.
+# at faster storage for a large book.
+DB_FILE = os.environ.get("RECIPE_DB", "recipes.db")
+
+_manager = None
+_manager_lock = threading.Lock()
+
+# Stay below SQLite's default limit of 999 bound parameters per statement.
+_MAX_SQL_VARIABLES = 900
+
+# ORDER BY clauses for load_recipes' order_by argument. Each one matches an
+# index created by init_db column for column, so sorting never needs a temp B-tree.
+SORT_ORDERS = {
+    "id": "id",
+    "name": "name COLLATE NOCASE, calories, id",
+    "calories": "calories, name, id",
+    "calories_desc": "calories DESC, name DESC, id DESC",
+}
+
+# At most this many recipes are read from any one LSH bucket when checking a
+# new recipe for duplicates, so a flood of identical recipes stays cheap.
+_MAX_BUCKET_CANDIDATES = 32
+
+# The signatures of every recipe sharing a bucket with a new one, in one
+# statement: a capped lookup per band, merged and joined to recipe_minhash.
+_CANDIDATES_QUERY = (
+    "SELECT m.recipe_id, m.signature FROM recipe_minhash m WHERE m.recipe_id IN ("
+    + " UNION ".join(["SELECT recipe_id FROM (SELECT recipe_id FROM recipe_lsh "
+                      "WHERE band = ? AND bucket = ? LIMIT ?)"] * minhash.BANDS)
+    + ") ORDER BY m.recipe_id")
+
+# Estimated Jaccard similarity at which a new recipe is flagged as a duplicate.
+DUPLICATE_THRESHOLD = 0.7
+
+# Bumped whenever init_db's _migrate gains a data migration.
+SCHEMA_VERSION = 3
+
+# Set by init_db (or lazily on first search) once we know whether this SQLite
+# build ships with the FTS5 extension.
+_fts5_available = None
+
+# Codecs from the body_codecs table, loaded on first use: (codecs by ID,
+# the newest codec, which new recipe bodies are written with).
+_body_codecs = None
+_body_codecs_lock = threading.Lock()
+
+# Callables notified as listener(event, recipe_ids) after recipes are saved
+# ("save") or deleted ("delete"). Used to invalidate in-memory caches.
+_change_listeners = []
+
+def add_change_listener(listener):
+    """Call listener(event, recipe_ids) whenever recipes are saved or deleted."""
+    _change_listeners.append(listener)
+
+def remove_change_listener(listener):
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+def _notify(event, recipe_ids):
+    for listener in list(_change_listeners):
+        listener(event, recipe_ids)
+
+def get_connections():
+    """Return the shared ConnectionManager for DB_FILE, creating it on first use."""
+    global _manager, _fts5_available, _body_codecs
+    with _manager_lock:
+        if _manager is None or _manager.path != DB_FILE:
+            if _manager is not None:
+                _manager.close()
+            _manager = ConnectionManager(DB_FILE, on_connect=_register_functions)
+            _fts5_available = None
+            _body_codecs = None
+        return _manager
+
+def _register_functions(conn):
+    # recipe_body() decodes stored recipe_text for the FTS triggers and LIKE search.
+    conn.create_function("recipe_body", 1, _decode_body, deterministic=True)
+
+def close_db():
+    """Close the pooled connections, e.g. when the application exits."""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
 
 def init_db():
     """Create the database and table if not already present."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS recipes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    ingredients TEXT,
-                    recipe_text TEXT,
-                    calories INTEGER
-                )''')
-    conn.commit()
-    conn.close()
+    global _fts5_available
+    with get_connections().write() as conn:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS recipes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT,
+                        ingredients TEXT,
+                        recipe_text TEXT,
+                        calories INTEGER
+                    )''')
+        # Raw model replies keyed by a hash of the request (see response_cache.py).
+        c.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)")
+        # Covering indexes for the list columns (id is the rowid, so it is
+        # stored in every index): calorie ranges/sorting and name sorting.
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recipes_calories ON recipes (calories, name)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recipes_name ON recipes (name COLLATE NOCASE, calories)")
+        # Normalized ingredient names and an inverted index from each name to
+        # the recipes that use it (see find_recipes_by_ingredients).
+        c.execute('''CREATE TABLE IF NOT EXISTS ingredients (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL UNIQUE
+                    )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS recipe_ingredients (
+                        ingredient_id INTEGER NOT NULL,
+                        recipe_id INTEGER NOT NULL,
+                        PRIMARY KEY (ingredient_id, recipe_id)
+                    ) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_recipe "
+                  "ON recipe_ingredients (recipe_id, ingredient_id)")
+        c.execute('''CREATE TRIGGER IF NOT EXISTS recipe_ingredients_ad AFTER DELETE ON recipes BEGIN
+                        DELETE FROM recipe_ingredients WHERE recipe_id = old.id;
+                    END''')
+        # Each ingredient line parsed into a canonical quantity, unit and
+        # name, so shopping lists are summed without re-parsing (see
+        # build_shopping_list).
+        c.execute('''CREATE TABLE IF NOT EXISTS recipe_quantities (
+                        recipe_id INTEGER NOT NULL,
+                        position INTEGER NOT NULL,
+                        quantity REAL,
+                        unit TEXT NOT NULL,
+                        item TEXT NOT NULL,
+                        PRIMARY KEY (recipe_id, position)
+                    ) WITHOUT ROWID''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS recipe_quantities_ad AFTER DELETE ON recipes BEGIN
+                        DELETE FROM recipe_quantities WHERE recipe_id = old.id;
+                    END''')
+        # MinHash signatures, their LSH band buckets, and the duplicates
+        # flagged when recipes were saved (see minhash.py and dedup.py).
+        c.execute('''CREATE TABLE IF NOT EXISTS recipe_minhash (
+                        recipe_id INTEGER PRIMARY KEY,
+                        signature BLOB NOT NULL
+                    )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS recipe_lsh (
+                        band INTEGER NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        recipe_id INTEGER NOT NULL,
+                        PRIMARY KEY (band, bucket, recipe_id)
+                    ) WITHOUT ROWID''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recipe_lsh_recipe ON recipe_lsh (recipe_id)")
+        c.execute('''CREATE TABLE IF NOT EXISTS recipe_duplicates (
+                        recipe_id INTEGER PRIMARY KEY,
+                        duplicate_of INTEGER NOT NULL,
+                        similarity REAL NOT NULL
+                    )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recipe_duplicates_of ON recipe_duplicates (duplicate_of)")
+        c.execute('''CREATE TRIGGER IF NOT EXISTS recipe_minhash_ad AFTER DELETE ON recipes BEGIN
+                        DELETE FROM recipe_minhash WHERE recipe_id = old.id;
+                        DELETE FROM recipe_lsh WHERE recipe_id = old.id;
+                        DELETE FROM recipe_duplicates WHERE recipe_id = old.id OR duplicate_of = old.id;
+                    END''')
+        # Ways recipe_text may be stored; the newest row is used for new
+        # recipes. An empty table means plain text (see compact_db.py).
+        c.execute('''CREATE TABLE IF NOT EXISTS body_codecs (
+                        id INTEGER PRIMARY KEY,
+                        method TEXT NOT NULL,
+                        level INTEGER,
+                        dictionary BLOB,
+                        created_at REAL NOT NULL
+                    )''')
+        _fts5_available = _init_fts(c)
+        _migrate(c)
+        if _fts5_available:
+            _sync_fts_triggers(c)
 
-def save_recipe(name, ingredients, recipe_text, calories):
-    """Insert a new recipe into the database."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO recipes (name, ingredients, recipe_text, calories) VALUES (?, ?, ?, ?)",
-        (name, ingredients, recipe_text, calories)
+def _migrate(c):
+    """Bring data in an existing database up to the current schema version."""
+    (version,) = c.execute("PRAGMA user_version").fetchone()
+    if version < 1:
+        # Version 1: index the ingredients of recipes saved before the
+        # recipe_ingredients table existed.
+        rows = c.execute("SELECT id, ingredients FROM recipes").fetchall()
+        for recipe_id, ingredients in rows:
+            _index_ingredients(c, recipe_id, ingredients)
+    if version < 2 and _fts5_available:
+        # Version 2: the FTS triggers decode compressed bodies when there
+        # may be any (see _create_fts_triggers).
+        _create_fts_triggers(c)
+    if 1 <= version < 3:
+        # Version 3: parse the ingredient quantities of existing recipes
+        # (version 0 databases were just indexed in full above).
+        rows = c.execute("SELECT id, ingredients FROM recipes").fetchall()
+        for recipe_id, ingredients in rows:
+            _index_quantities(c, recipe_id, [parse_ingredient(item) for item in split_ingredients(ingredients)])
+    c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _index_ingredients(c, recipe_id, ingredients):
+    """Record the ingredients of one recipe in recipe_ingredients and recipe_quantities."""
+    items = split_ingredients(ingredients)
+    names = {normalize_ingredient(item) for item in items}
+    names.discard("")
+    _index_quantities(c, recipe_id, [parse_ingredient(item) for item in items])
+    for name in names:
+        c.execute("INSERT OR IGNORE INTO ingredients (name) VALUES (?)", (name,))
+        c.execute(
+            "INSERT OR IGNORE INTO recipe_ingredients (ingredient_id, recipe_id) "
+            "SELECT id, ? FROM ingredients WHERE name = ?",
+            (recipe_id, name)
+        )
+
+def _index_quantities(c, recipe_id, parsed):
+    """Store the parsed (quantity, unit, name) ingredient lines of one recipe."""
+    c.executemany(
+        "INSERT OR REPLACE INTO recipe_quantities (recipe_id, position, quantity, unit, item) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(recipe_id, position, quantity, unit, item)
+         for position, (quantity, unit, item) in enumerate(parsed) if item]
     )
-    conn.commit()
-    conn.close()
-
-def load_recipes(search_text="", max_cal=None):
-    """Return a list of recipes, optionally filtered by search criteria."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    query = "SELECT id, name, calories, ingredients FROM recipes WHERE 1=1"
-    params = []
-    if search_text:
-        query += " AND (name LIKE ? OR ingredients LIKE ? OR recipe_text LIKE ?)"
-        like_param = f"%{search_text}%"
-        params.extend([like_param, like_param, like_param])
+
+def _index_minhash(c, recipe_id, sig):
+    """Store a recipe's MinHash signature and LSH buckets, flagging a duplicate.
+
+    Only recipes sharing a bucket with the new one are compared, so the
+    check costs a fixed number of index lookups however large the book is.
+    Returns (duplicate_of, similarity), or None if no close match was found.
+    """
+    if sig is None:
+        return None
+    keys = minhash.band_keys(sig)
+    c.execute(_CANDIDATES_QUERY, [value for band, bucket in keys
+                                  for value in (band, bucket, _MAX_BUCKET_CANDIDATES)])
+    candidates = c.fetchall()
+    best = None
+    if candidates:
+        scores = minhash.similarities(sig, [blob for _, blob in candidates])
+        # argmax picks the first of equal scores, i.e. the oldest candidate.
+        top = int(scores.argmax())
+        if scores[top] >= DUPLICATE_THRESHOLD:
+            best = (candidates[top][0], float(scores[top]))
+    c.execute("INSERT OR REPLACE INTO recipe_minhash (recipe_id, signature) VALUES (?, ?)",
+              (recipe_id, minhash.pack(sig)))
+    c.executemany("INSERT OR IGNORE INTO recipe_lsh (band, bucket, recipe_id) VALUES (?, ?, ?)",
+                  [(band, bucket, recipe_id) for band, bucket in keys])
+    if best is not None:
+        c.execute("INSERT OR REPLACE INTO recipe_duplicates (recipe_id, duplicate_of, similarity) "
+                  "VALUES (?, ?, ?)", (recipe_id, best[0], best[1]))
+    return best
+
+def _init_fts(c):
+    """Create the FTS5 index and its sync triggers, backfilling it if new.
+
+    Returns False when FTS5 is not compiled into this SQLite build.
+    """
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recipes_fts'")
+    if c.fetchone():
+        return True
+    try:
+        c.execute('''CREATE VIRTUAL TABLE recipes_fts USING fts5(
+                        name,
+                        ingredients,
+                        recipe_text,
+                        content='recipes',
+                        content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2',
+                        prefix='2 3'
+                    )''')
+    except sqlite3.OperationalError:
+        return False
+    _create_fts_triggers(c)
+    # Index any recipes that were saved before the FTS table existed. This is
+    # not a 'rebuild', which would index compressed bodies as stored.
+    c.execute("INSERT INTO recipes_fts (rowid, name, ingredients, recipe_text) "
+              "SELECT id, name, ingredients, recipe_body(recipe_text) FROM recipes")
+    return True
+
+def _bodies_encoded(c):
+    """True once a compressing codec has been configured for recipe bodies."""
+    return c.execute("SELECT 1 FROM body_codecs WHERE method != 'plain' LIMIT 1").fetchone() is not None
+
+def _sync_fts_triggers(c):
+    """Recreate the FTS triggers if they don't match how bodies are stored."""
+    row = c.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'recipes_fts_ai'").fetchone()
+    if row is None or ("recipe_body(" in row[0]) != _bodies_encoded(c):
+        _create_fts_triggers(c)
+
+def _create_fts_triggers(c):
+    """(Re)create the triggers that keep the external-content FTS index in step.
+
+    Only once bodies may be compressed do the triggers index
+    recipe_body(recipe_text). That function exists only on this module's
+    connections, so until then plain triggers keep the table writable from
+    any SQLite connection.
+    """
+    if _bodies_encoded(c):
+        old_body, new_body = "recipe_body(old.recipe_text)", "recipe_body(new.recipe_text)"
+    else:
+        old_body, new_body = "old.recipe_text", "new.recipe_text"
+    for trigger in ("recipes_fts_ai", "recipes_fts_ad", "recipes_fts_au"):
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    c.execute(f'''CREATE TRIGGER recipes_fts_ai AFTER INSERT ON recipes BEGIN
+                    INSERT INTO recipes_fts (rowid, name, ingredients, recipe_text)
+                    VALUES (new.id, new.name, new.ingredients, {new_body});
+                END''')
+    c.execute(f'''CREATE TRIGGER recipes_fts_ad AFTER DELETE ON recipes BEGIN
+                    INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, recipe_text)
+                    VALUES ('delete', old.id, old.name, old.ingredients, {old_body});
+                END''')
+    # Re-encoding a body (compact_db.py) leaves its text alone, so skip the reindex.
+    c.execute(f'''CREATE TRIGGER recipes_fts_au AFTER UPDATE ON recipes
+                WHEN old.name IS NOT new.name OR old.ingredients IS NOT new.ingredients
+                    OR {old_body} IS NOT {new_body}
+                BEGIN
+                    INSERT INTO recipes_fts (recipes_fts, rowid, name, ingredients, recipe_text)
+                    VALUES ('delete', old.id, old.name, old.ingredients, {old_body});
+                    INSERT INTO recipes_fts (rowid, name, ingredients, recipe_text)
+                    VALUES (new.id, new.name, new.ingredients, {new_body});
+                END''')
+
+def _load_body_codecs():
+    """Return (codecs by ID, newest codec) from the body_codecs table, cached."""
+    global _body_codecs
+    with _body_codecs_lock:
+        if _body_codecs is None:
+            with get_connections().read() as conn:
+                try:
+                    rows = conn.execute(
+                        "SELECT id, method, level, dictionary FROM body_codecs ORDER BY id").fetchall()
+                except sqlite3.OperationalError:
+                    rows = []  # init_db has not run yet.
+            codecs = {row[0]: compression.Codec(*row) for row in rows}
+            _body_codecs = (codecs, codecs[rows[-1][0]] if rows else None)
+        return _body_codecs
+
+def _encode_body(recipe_text):
+    """Return recipe_text as it should be stored under the current codec."""
+    active = _load_body_codecs()[1]
+    return recipe_text if active is None else active.encode(recipe_text)
+
+def _decode_body(value):
+    """Return the text of a stored recipe_text value, compressed or not."""
+    global _body_codecs
+    codecs = _load_body_codecs()[0]
+    try:
+        return compression.decode(value, codecs)
+    except KeyError:
+        # Written under a codec added since we loaded them (e.g. by compact_db.py).
+        with _body_codecs_lock:
+            _body_codecs = None
+        return compression.decode(value, _load_body_codecs()[0])
+
+def _fts_enabled(c):
+    """Return True if the FTS5 index exists in the current database."""
+    global _fts5_available
+    if _fts5_available is None:
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recipes_fts'")
+        _fts5_available = c.fetchone() is not None
+    return _fts5_available
+
+def _fts_query(search_text):
+    """Turn free text into an FTS5 MATCH expression of prefix terms.
+
+    Every word must match (implicit AND) and the last one is treated as a
+    prefix, so partially typed words still find results. Returns None if the
+    text contains no searchable words.
+    """
+    terms = re.findall(r"\w+", search_text)
+    if not terms:
+        return None
+    # Quote each term so FTS5 operators (AND, NEAR, ...) are matched literally.
+    return " ".join(f'"{term}"' for term in terms) + "*"
+
+@metrics.timed("db.save_recipe_seconds")
+def save_recipe(name, ingredients, recipe_text, calories):
+    """Insert a new recipe into the database and return its ID."""
+    body = _encode_body(recipe_text)
+    sig = minhash.signature(ingredients, recipe_text)
+    with get_connections().write() as conn:
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO recipes (name, ingredients, recipe_text, calories) VALUES (?, ?, ?, ?)",
+            (name, ingredients, body, calories)
+        )
+        recipe_id = c.lastrowid
+        _index_ingredients(c, recipe_id, ingredients)
+        _index_minhash(c, recipe_id, sig)
+    _notify("save", [recipe_id])
+    return recipe_id
+
+@metrics.timed("db.save_recipes_seconds")
+def save_recipes(recipes):
+    """Insert many recipes in a single transaction and return how many were saved.
+
+    recipes is an iterable of (name, ingredients, recipe_text, calories) tuples.
+    """
+    recipes = list(recipes)
+    # Sign the whole batch at once, before the write transaction starts.
+    signatures = list(minhash.signatures(
+        (ingredients, recipe_text) for _, ingredients, recipe_text, _ in recipes))
+    recipe_ids = []
+    with get_connections().write() as conn:
+        c = conn.cursor()
+        # One cached statement per row rather than executemany, because each
+        # new ID is needed to index the recipe's ingredients.
+        for (name, ingredients, recipe_text, calories), sig in zip(recipes, signatures):
+            c.execute(
+                "INSERT INTO recipes (name, ingredients, recipe_text, calories) VALUES (?, ?, ?, ?)",
+                (name, ingredients, _encode_body(recipe_text), calories)
+            )
+            recipe_id = c.lastrowid
+            recipe_ids.append(recipe_id)
+            _index_ingredients(c, recipe_id, ingredients)
+            _index_minhash(c, recipe_id, sig)
+    if recipe_ids:
+        _notify("save", recipe_ids)
+    return len(recipe_ids)
+
+def _recipe_query(columns, search_text="", min_cal=None, max_cal=None, order_by=None):
+    """Build the SELECT for a recipe search and return (query, params).
+
+    columns are names from the recipes table. Text searches go through the
+    FTS5 index and default to relevance order (ties broken by ID); text
+    with no searchable words (e.g. "+++") filters nothing. A LIKE scan is
+    used only when FTS5 is unavailable. order_by may name any key of
+    SORT_ORDERS; other queries default to ID order.
+    """
+    if order_by is not None and order_by not in SORT_ORDERS:
+        raise ValueError(f"unknown sort order: {order_by!r}")
+    with get_connections().read() as conn:
+        fts = _fts_enabled(conn.cursor())
+    match = _fts_query(search_text) if search_text and fts else None
+    if match:
+        prefix = "r."
+        select = ", ".join(prefix + column for column in columns)
+        query = (f"SELECT {select} "
+                 "FROM recipes_fts JOIN recipes r ON r.id = recipes_fts.rowid "
+                 "WHERE recipes_fts MATCH ?")
+        params = [match]
+    else:
+        prefix = ""
+        query = f"SELECT {', '.join(columns)} FROM recipes WHERE 1=1"
+        params = []
+        if search_text and not fts:
+            query += " AND (name LIKE ? OR ingredients LIKE ? OR recipe_body(recipe_text) LIKE ?)"
+            like_param = f"%{search_text}%"
+            params.extend([like_param, like_param, like_param])
+    if min_cal is not None:
+        query += f" AND {prefix}calories >= ?"
+        params.append(min_cal)
     if max_cal is not None:
-        query += " AND calories <= ?"
+        query += f" AND {prefix}calories <= ?"
         params.append(max_cal)
-    c.execute(query, params)
-    results = c.fetchall()
-    conn.close()
-    return results
+    if order_by is None and prefix:
+        # Weight name hits above ingredient hits above instruction hits.
+        query += " ORDER BY bm25(recipes_fts, 10.0, 5.0, 1.0), r.id"
+    else:
+        order = SORT_ORDERS[order_by or "id"]
+        if prefix:
+            order = ", ".join(prefix + term.strip() for term in order.split(","))
+        query += f" ORDER BY {order}"
+    return query, params
+
+@metrics.timed("db.load_recipes_seconds")
+def load_recipes(search_text="", max_cal=None, min_cal=None, order_by=None, limit=None):
+    """Return a list of recipes, optionally filtered by search criteria.
+
+    Text searches go through the FTS5 index and are ordered by relevance
+    unless order_by (a key of SORT_ORDERS) says otherwise; a LIKE scan is
+    used only when FTS5 is unavailable. min_cal/max_cal bound the calories.
+    """
+    query, params = _recipe_query(("id", "name", "calories", "ingredients"),
+                                  search_text, min_cal, max_cal, order_by)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with get_connections().read() as conn:
+        return conn.execute(query, params).fetchall()
+
+@metrics.timed("db.load_recipe_page_seconds")
+def load_recipe_page(search_text="", max_cal=None, min_cal=None, order_by=None, limit=200, offset=0):
+    """Return one page of (id, name, calories) rows for the recipe list.
+
+    Rows come back in the same order as load_recipes, so consecutive pages
+    can be concatenated. Outside of text searches these queries are
+    answered from the covering indexes alone.
+    """
+    query, params = _recipe_query(("id", "name", "calories"), search_text, min_cal, max_cal, order_by)
+    query += " LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+    with get_connections().read() as conn:
+        return conn.execute(query, params).fetchall()
+
+def iter_recipe_rows(search_text="", max_cal=None, min_cal=None, order_by=None, limit=None,
+                     batch_size=500):
+    """Yield lists of up to batch_size (id, name, calories) rows for a search.
+
+    Takes the same filters as load_recipe_page but pages through one cursor
+    with fetchmany, for streaming result sets too large to build as a list.
+    Consume it from a single thread: it holds that thread's reader open.
+    """
+    query, params = _recipe_query(("id", "name", "calories"), search_text, min_cal, max_cal, order_by)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with get_connections().read() as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+@metrics.timed("db.get_recipe_seconds")
+def get_recipe(recipe_id):
+    """Return (id, name, ingredients, recipe_text, calories) for a recipe, or None."""
+    with get_connections().read() as conn:
+        row = conn.execute(
+            "SELECT id, name, ingredients, recipe_text, calories FROM recipes WHERE id = ?",
+            (recipe_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    return row[:3] + (_decode_body(row[3]), row[4])
+
+@metrics.timed("db.get_recipe_text_seconds")
+def get_recipe_text(recipe_id):
+    """Return the full recipe text for the given ID, or None if it is gone."""
+    with get_connections().read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT recipe_text FROM recipes WHERE id = ?", (recipe_id,))
+        row = c.fetchone()
+    return _decode_body(row[0]) if row else None
+
+@metrics.timed("db.get_recipe_texts_seconds")
+def get_recipe_texts(recipe_ids):
+    """Return a dict mapping each existing ID in recipe_ids to its recipe text."""
+    recipe_ids = list(recipe_ids)
+    texts = {}
+    with get_connections().read() as conn:
+        for start in range(0, len(recipe_ids), _MAX_SQL_VARIABLES):
+            chunk = recipe_ids[start:start + _MAX_SQL_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            texts.update(conn.execute(
+                f"SELECT id, recipe_text FROM recipes WHERE id IN ({placeholders})", chunk))
+    return {recipe_id: _decode_body(body) for recipe_id, body in texts.items()}
 
+def iter_recipes(batch_size=1000):
+    """Yield (id, name, ingredients, recipe_text, calories) for every recipe in ID order.
+
+    Rows are fetched batch_size at a time from one read snapshot, so memory
+    use stays flat however large the table is.
+    """
+    with get_connections().read() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, name, ingredients, recipe_text, calories FROM recipes ORDER BY id")
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                return
+            for recipe_id, name, ingredients, body, calories in rows:
+                yield recipe_id, name, ingredients, _decode_body(body), calories
+
+def recipe_exists(name, ingredients, recipe_text):
+    """Return True if a recipe with exactly this name, ingredients and text is saved."""
+    with get_connections().read() as conn:
+        # COLLATE NOCASE lets idx_recipes_name find the candidates.
+        rows = conn.execute(
+            "SELECT name, recipe_text FROM recipes WHERE name = ? COLLATE NOCASE AND ingredients IS ?",
+            (name, ingredients)
+        ).fetchall()
+    return any(row_name == name and _decode_body(body) == recipe_text for row_name, body in rows)
+
+def load_recipes_by_ids(recipe_ids):
+    """Return (id, name, calories) rows for recipe_ids, in the order given."""
+    recipe_ids = list(recipe_ids)
+    rows = {}
+    with get_connections().read() as conn:
+        for start in range(0, len(recipe_ids), _MAX_SQL_VARIABLES):
+            chunk = recipe_ids[start:start + _MAX_SQL_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            for row in conn.execute(
+                    f"SELECT id, name, calories FROM recipes WHERE id IN ({placeholders})", chunk):
+                rows[row[0]] = row
+    return [rows[recipe_id] for recipe_id in recipe_ids if recipe_id in rows]
+
+def get_duplicate_of(recipe_id):
+    """Return (duplicate_of, similarity) if the recipe was flagged as a near-duplicate."""
+    with get_connections().read() as conn:
+        return conn.execute(
+            "SELECT duplicate_of, similarity FROM recipe_duplicates WHERE recipe_id = ?", (recipe_id,)
+        ).fetchone()
+
+@metrics.timed("db.delete_recipe_seconds")
 def delete_recipe(recipe_id):
-    """Delete the recipe with the given ID."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
-    conn.commit()
-    conn.close()
+    """Delete the recipe with the given ID and return 1, or 0 if there was none."""
+    with get_connections().write() as conn:
+        deleted = conn.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,)).rowcount
+    if deleted:
+        _notify("delete", [recipe_id])
+    return deleted
+
+@metrics.timed("db.delete_recipes_seconds")
+def delete_recipes(recipe_ids):
+    """Delete all recipes with the given IDs in a single transaction and return how many existed."""
+    recipe_ids = list(recipe_ids)
+    deleted = 0
+    with get_connections().write() as conn:
+        for start in range(0, len(recipe_ids), _MAX_SQL_VARIABLES):
+            chunk = recipe_ids[start:start + _MAX_SQL_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            deleted += conn.execute(f"DELETE FROM recipes WHERE id IN ({placeholders})", chunk).rowcount
+    if deleted:
+        _notify("delete", recipe_ids)
+    return deleted
+
+def _ingredient_terms(terms):
+    """Normalize query terms the same way stored ingredients are normalized."""
+    normalized = {normalize_ingredient(term) for term in terms}
+    normalized.discard("")
+    return sorted(normalized)
+
+def _ingredient_ids(term):
+    """Return SQL selecting the IDs of ingredients matching term, and its params.
+
+    A term matches an ingredient name equal to it or containing it as whole
+    words, so "chicken" also finds "chicken breast". This only scans the
+    small ingredients vocabulary, never the recipes.
+    """
+    sql = ("SELECT id FROM ingredients WHERE name = ? OR name LIKE ? "
+           "OR name LIKE ? OR name LIKE ?")
+    return sql, [term, f"{term} %", f"% {term}", f"% {term} %"]
+
+def _recipes_with(term):
+    """Return SQL selecting the IDs of recipes using an ingredient matching term."""
+    sql, params = _ingredient_ids(term)
+    return f"SELECT recipe_id FROM recipe_ingredients WHERE ingredient_id IN ({sql})", params
+
+@metrics.timed("db.find_recipes_by_ingredients_seconds")
+def find_recipes_by_ingredients(include=(), exclude=(), limit=200):
+    """Return (id, name, calories) rows for recipes using every include and no exclude ingredient.
+
+    Matching intersects and subtracts per-ingredient recipe sets from the
+    recipe_ingredients index instead of scanning ingredient text.
+    """
+    query, params = _ingredient_filter(include, exclude)
+    query = (f"SELECT id, name, calories FROM recipes WHERE id IN ({query}) "
+             "ORDER BY id LIMIT ?")
+    params.append(limit)
+    with get_connections().read() as conn:
+        return conn.execute(query, params).fetchall()
+
+def _ingredient_filter(include, exclude):
+    """Return SQL selecting the IDs of recipes matching include/exclude terms, and its params."""
+    include = _ingredient_terms(include)
+    exclude = _ingredient_terms(exclude)
+    parts = []
+    params = []
+    for term in include:
+        sql, term_params = _recipes_with(term)
+        parts.append(sql)
+        params.extend(term_params)
+    query = " INTERSECT ".join(parts) if parts else "SELECT id FROM recipes"
+    for term in exclude:
+        sql, term_params = _recipes_with(term)
+        query += " EXCEPT " + sql
+        params.extend(term_params)
+    return query, params
+
+@metrics.timed("db.load_calorie_candidates_seconds")
+def load_calorie_candidates(include=(), exclude=(), min_cal=None, max_cal=None):
+    """Return (id, calories) rows for recipes with a known calorie count matching the filters.
+
+    Include/exclude terms match ingredients as in find_recipes_by_ingredients.
+    Without include terms only the covering calories index is read.
+    """
+    conditions = ["calories > 0"]
+    params = []
+    if include or exclude:
+        query, params = _ingredient_filter(include, exclude)
+        conditions.append(f"id IN ({query})")
+    if min_cal is not None:
+        conditions.append("calories >= ?")
+        params.append(min_cal)
+    if max_cal is not None:
+        conditions.append("calories <= ?")
+        params.append(max_cal)
+    with get_connections().read() as conn:
+        return conn.execute(
+            f"SELECT id, calories FROM recipes WHERE {' AND '.join(conditions)}", params
+        ).fetchall()
+
+@metrics.timed("db.pantry_match_seconds")
+def pantry_match(pantry, exclude=(), limit=50):
+    """Rank recipes by how few ingredients are missing from pantry.
+
+    Returns (id, name, calories, matched, missing) rows, fewest missing
+    first. Only recipes using at least one pantry ingredient are considered.
+    """
+    pantry = _ingredient_terms(pantry)
+    if not pantry:
+        return []
+    conditions = []
+    params = []
+    for term in pantry:
+        sql, term_params = _ingredient_ids(term)
+        conditions.append(sql)
+        params.extend(term_params)
+    have = " UNION ".join(conditions)
+    query = (f"WITH have(id) AS ({have}), "
+             "matches AS (SELECT recipe_id, COUNT(*) AS matched FROM recipe_ingredients "
+             "            WHERE ingredient_id IN (SELECT id FROM have) GROUP BY recipe_id) "
+             "SELECT r.id, r.name, r.calories, m.matched, "
+             "       (SELECT COUNT(*) FROM recipe_ingredients ri WHERE ri.recipe_id = m.recipe_id) "
+             "       - m.matched AS missing "
+             "FROM matches m JOIN recipes r ON r.id = m.recipe_id")
+    excluded = _ingredient_terms(exclude)
+    if excluded:
+        subqueries = []
+        for term in excluded:
+            sql, term_params = _recipes_with(term)
+            subqueries.append(sql)
+            params.extend(term_params)
+        query += f" WHERE r.id NOT IN ({' UNION '.join(subqueries)})"
+    query += " ORDER BY missing, m.matched DESC, r.id LIMIT ?"
+    params.append(limit)
+    with get_connections().read() as conn:
+        return conn.execute(query, params).fetchall()
+
+@metrics.timed("db.build_shopping_list_seconds")
+def build_shopping_list(recipe_ids):
+    """Return (name, quantity, unit) items summed over recipe_ids, sorted by name.
+
+    Lines of the same ingredient in the same canonical unit are added up; an
+    ingredient listed without a quantity anywhere has quantity None. The
+    parsed lines come from recipe_quantities by primary key, so nothing is
+    parsed again here.
+    """
+    recipe_ids = list(recipe_ids)
+    totals = {}
+    with get_connections().read() as conn:
+        for start in range(0, len(recipe_ids), _MAX_SQL_VARIABLES):
+            chunk = recipe_ids[start:start + _MAX_SQL_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            for item, unit, quantity in conn.execute(
+                    f"SELECT item, unit, SUM(quantity) FROM recipe_quantities "
+                    f"WHERE recipe_id IN ({placeholders}) GROUP BY item, unit", chunk):
+                key = (item, unit)
+                if quantity is not None:
+                    quantity += totals.get(key) or 0
+                elif key in totals:
+                    quantity = totals[key]
+                totals[key] = quantity
+    # A line without a quantity adds nothing when the same ingredient is
+    # also listed with one.
+    measured = {item for (item, _), quantity in totals.items() if quantity is not None}
+    return [(item, quantity, unit) for (item, unit), quantity in sorted(totals.items())
+            if quantity is not None or item not in measured]
+
+def set_body_codec(method, level=None, dictionary=None):
+    """Make method ("plain", "zlib" or "zstd") the codec for new recipe bodies.
+
+    dictionary is an optional shared dictionary (see compression.train_dictionary).
+    Existing rows keep their encoding until recompress_bodies rewrites them.
+    Returns the new codec's ID.
+    """
+    global _body_codecs
+    compression.Codec(0, method, level, dictionary)  # Validate before storing.
+    with get_connections().write() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO body_codecs (method, level, dictionary, created_at) VALUES (?, ?, ?, ?)",
+                  (method, level, dictionary, time.time()))
+        codec_id = c.lastrowid
+        if _fts_enabled(c):
+            _sync_fts_triggers(c)
+    with _body_codecs_lock:
+        _body_codecs = None
+    return codec_id
+
+def recompress_bodies(batch_size=500, progress=None):
+    """Rewrite every recipe body not stored with the current codec.
+
+    Rows are rewritten in batches of batch_size, one transaction each, so
+    other writers are never blocked for long. progress, if given, is called
+    with the number of rows rewritten so far. Returns the total.
+    """
+    active = _load_body_codecs()[1]
+    active_id = active.id if active is not None and active.method != "plain" else None
+    last_id = 0
+    rewritten = 0
+    while True:
+        with get_connections().read() as conn:
+            rows = conn.execute(
+                "SELECT id, recipe_text FROM recipes WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+        if not rows:
+            return rewritten
+        last_id = rows[-1][0]
+        updates = [(_encode_body(_decode_body(body)), recipe_id) for recipe_id, body in rows
+                   if body is not None and compression.codec_id(body) != active_id]
+        if updates:
+            with get_connections().write() as conn:
+                conn.executemany("UPDATE recipes SET recipe_text = ? WHERE id = ?", updates)
+            rewritten += len(updates)
+            if progress is not None:
+                progress(rewritten)
+
+def index_missing_signatures(batch_size=500, progress=None):
+    """Compute MinHash signatures for recipes saved before deduplication existed.
+
+    Rows are processed in ID order, so earlier recipes are the originals that
+    later ones are flagged against. progress, if given, is called with the
+    number of recipes indexed so far. Returns the total.
+    """
+    last_id = 0
+    indexed = 0
+    while True:
+        with get_connections().read() as conn:
+            rows = conn.execute(
+                "SELECT id, ingredients, recipe_text FROM recipes "
+                "WHERE id > ? AND id NOT IN (SELECT recipe_id FROM recipe_minhash) "
+                "ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+        if not rows:
+            return indexed
+        last_id = rows[-1][0]
+        signatures = minhash.signatures((ingredients, _decode_body(body)) for _, ingredients, body in rows)
+        with get_connections().write() as conn:
+            c = conn.cursor()
+            for (recipe_id, _, _), sig in zip(rows, list(signatures)):
+                _index_minhash(c, recipe_id, sig)
+        indexed += len(rows)
+        if progress is not None:
+            progress(indexed)
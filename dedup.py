@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Find clusters of near-duplicate recipes using the MinHash LSH index.
+
+New recipes are signed and checked for duplicates as they are saved (see
+db._index_minhash). This command signs any recipes saved before that,
+then groups every recipe whose estimated Jaccard similarity to another
+member of its cluster is at least --threshold. Only recipes sharing an LSH
+bucket are ever compared, and each only with that bucket's oldest recipe.
+"""
+import argparse
+import json
+import sys
+
+import db
+import minhash
+
+class _DisjointSet:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Keep the oldest recipe as the root.
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+def _load_signatures(recipe_ids):
+    signatures = {}
+    recipe_ids = list(recipe_ids)
+    with db.get_connections().read() as conn:
+        for start in range(0, len(recipe_ids), db._MAX_SQL_VARIABLES):
+            chunk = recipe_ids[start:start + db._MAX_SQL_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            for recipe_id, blob in conn.execute(
+                    f"SELECT recipe_id, signature FROM recipe_minhash WHERE recipe_id IN ({placeholders})",
+                    chunk):
+                signatures[recipe_id] = minhash.unpack(blob)
+    return signatures
+
+def find_clusters(threshold=db.DUPLICATE_THRESHOLD):
+    """Return clusters of near-duplicate recipe IDs, largest first.
+
+    Each cluster is a sorted list of two or more IDs; the first is the oldest.
+    """
+    with db.get_connections().read() as conn:
+        buckets = [[int(i) for i in members.split(",")] for (members,) in conn.execute(
+            "SELECT group_concat(recipe_id) FROM recipe_lsh "
+            "GROUP BY band, bucket HAVING COUNT(*) > 1")]
+    signatures = _load_signatures({i for members in buckets for i in members})
+    clusters = _DisjointSet()
+    for members in buckets:
+        # Compare each member with the bucket's oldest recipe only, so a
+        # bucket costs one comparison per member rather than one per pair.
+        representative, *rest = sorted(members)
+        for member in rest:
+            if clusters.find(member) == clusters.find(representative):
+                continue
+            if minhash.similarity(signatures[representative], signatures[member]) >= threshold:
+                clusters.union(representative, member)
+    groups = {}
+    for recipe_id in clusters.parent:
+        groups.setdefault(clusters.find(recipe_id), []).append(recipe_id)
+    result = [sorted(group) for group in groups.values() if len(group) > 1]
+    result.sort(key=lambda group: (-len(group), group[0]))
+    return result
+
+def _names(recipe_ids):
+    names = {}
+    with db.get_connections().read() as conn:
+        for start in range(0, len(recipe_ids), db._MAX_SQL_VARIABLES):
+            chunk = recipe_ids[start:start + db._MAX_SQL_VARIABLES]
+            placeholders = ", ".join("?" * len(chunk))
+            names.update(conn.execute(
+                f"SELECT id, name FROM recipes WHERE id IN ({placeholders})", chunk))
+    return names
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=db.DB_FILE,
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    parser.add_argument("--threshold", type=float, default=db.DUPLICATE_THRESHOLD,
+                        help="minimum estimated Jaccard similarity (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print clusters as JSON")
+    parser.add_argument("--delete", action="store_true",
+                        help="delete every recipe in a cluster except the oldest")
+    args = parser.parse_args(argv)
+
+    db.DB_FILE = args.db
+    db.init_db()
+    indexed = db.index_missing_signatures(
+        progress=lambda n: print(f"signed {n} recipes", file=sys.stderr))
+    if indexed:
+        print(f"signed {indexed} existing recipes", file=sys.stderr)
+
+    clusters = find_clusters(args.threshold)
+    names = _names([i for cluster in clusters for i in cluster])
+    if args.json:
+        print(json.dumps([[{"id": i, "name": names.get(i)} for i in cluster] for cluster in clusters],
+                         indent=2))
+    else:
+        for cluster in clusters:
+            print(f"{len(cluster)} recipes:")
+            for recipe_id in cluster:
+                print(f"  {recipe_id:>8}  {names.get(recipe_id)}")
+        duplicates = sum(len(cluster) - 1 for cluster in clusters)
+        print(f"{len(clusters)} clusters, {duplicates} duplicates", file=sys.stderr)
+    if args.delete:
+        doomed = [i for cluster in clusters for i in cluster[1:]]
+        db.delete_recipes(doomed)
+        print(f"deleted {len(doomed)} recipes", file=sys.stderr)
+    db.close_db()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import metrics
+
+class RecipeDetailCache:
+    """Bounded LRU cache of recipe texts keyed by recipe ID.
+
+    get() serves the detail pane; prefetch() loads neighbouring rows on a
+    background thread so moving the selection rarely touches the disk.
+    Entries are dropped through db's change listeners whenever recipes are
+    saved or deleted. Each invalidation bumps a generation counter, and a
+    prefetch that started before it discards its rows instead of caching
+    text that may already be stale.
+    """
+
+    def __init__(self, max_entries=256, fetch_many=db.get_recipe_texts):
+        self.max_entries = max_entries
+        self.fetch_many = fetch_many
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        db.add_change_listener(self._on_change)
+
+    def get(self, recipe_id):
+        """Return the text for recipe_id, loading it on a miss (None if gone)."""
+        with self._lock:
+            text = self._entries.get(recipe_id)
+            if text is not None:
+                self._entries.move_to_end(recipe_id)
+                self.hits += 1
+                metrics.inc("detail_cache.hits")
+                return text
+            self.misses += 1
+            generation = self._generation
+        metrics.inc("detail_cache.misses")
+        text = self.fetch_many([recipe_id]).get(recipe_id)
+        if text is not None:
+            self._store({recipe_id: text}, generation)
+        return text
+
+    def prefetch(self, recipe_ids):
+        """Load any of recipe_ids that are not cached yet on a background thread."""
+        with self._lock:
+            wanted = [i for i in recipe_ids
+                      if i not in self._entries and i not in self._pending]
+            if not wanted:
+                return
+            self._pending.update(wanted)
+            generation = self._generation
+        self._executor.submit(self._prefetch, wanted, generation)
+
+    def _prefetch(self, recipe_ids, generation):
+        try:
+            self._store(self.fetch_many(recipe_ids), generation)
+            metrics.inc("detail_cache.prefetched", len(recipe_ids))
+        finally:
+            with self._lock:
+                self._pending.difference_update(recipe_ids)
+
+    def _store(self, texts, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            for recipe_id, text in texts.items():
+                self._entries[recipe_id] = text
+                self._entries.move_to_end(recipe_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, recipe_ids=None):
+        """Forget the given IDs, or every entry when recipe_ids is None."""
+        with self._lock:
+            self._generation += 1
+            if recipe_ids is None:
+                self._entries.clear()
+            else:
+                for recipe_id in recipe_ids:
+                    self._entries.pop(recipe_id, None)
+
+    def _on_change(self, event, recipe_ids):
+        self.invalidate(recipe_ids)
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def shutdown(self):
+        db.remove_change_listener(self._on_change)
+        self._executor.shutdown(wait=False)
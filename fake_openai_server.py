@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Serve a local stand-in for the OpenAI chat completions endpoint.
+
+Replies are valid recipe JSON in the shape openai_integration expects,
+with configurable latency, streaming, and injected errors, 429s and
+malformed JSON. Point the app at it with OPENAI_API_BASE, e.g.
+
+    python3 fake_openai_server.py --port 8808 --latency lognormal:0.8:0.5 --rate-limit-rate 0.05
+    OPENAI_API_BASE=http://127.0.0.1:8808/v1 python3 batch_generate.py prompts.txt
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def parse_latency(spec):
+    """Return a function producing latencies (seconds) from a spec string.
+
+    Specs: "fixed:S", "uniform:LOW:HIGH", "lognormal:MEDIAN:SIGMA" and
+    "exp:MEAN". A bare number is treated as fixed.
+    """
+    kind, _, rest = spec.partition(":")
+    if not rest:
+        value = float(kind)
+        return lambda rng: value
+    args = [float(part) for part in rest.split(":")]
+    if kind == "fixed":
+        return lambda rng: args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / args[0])
+    raise ValueError(f"unknown latency distribution: {spec!r}")
+
+def fake_recipe(prompt, rng):
+    """Return a plausible recipe dict for prompt."""
+    words = [word for word in prompt.split() if word.isalpha()] or ["house"]
+    ingredients = words[:3] + rng.sample(["onion", "garlic", "olive oil", "salt", "pepper",
+                                          "tomato", "rice", "beans", "lemon"], 4)
+    steps = " ".join(f"{i}. Step {i} for the {rng.choice(ingredients)}." for i in range(1, rng.randint(4, 8)))
+    return {
+        "name": " ".join(words[:4]).title() + " " + rng.choice(["Stew", "Salad", "Bowl", "Bake"]),
+        "ingredients": ", ".join(f"{rng.randint(1, 3)} cups {item}" for item in ingredients),
+        "calories": rng.randint(150, 1200),
+        "recipe_text": steps,
+    }
+
+class FakeOpenAIServer:
+    """Threaded HTTP server emulating POST /v1/chat/completions.
+
+    Usable as a context manager; url is the value for openai.api_base.
+    Each request independently fails with a 429 (rate_limit_rate), a 500
+    (error_rate), or returns content that is not valid JSON (malformed_rate).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency="fixed:0.05", chunk_delay=0.005,
+                 chunk_size=16, error_rate=0.0, rate_limit_rate=0.0, malformed_rate=0.0,
+                 retry_after=1, seed=None):
+        self.latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "streamed": 0, "errors": 0, "rate_limited": 0, "malformed": 0}
+        self._lock = threading.Lock()
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _draw(self):
+        """Pick this request's outcome and latency under the lock (Random is shared)."""
+        with self._lock:
+            roll = self.rng.random()
+            delay = max(0.0, self.latency(self.rng))
+            seed = self.rng.random()
+        if roll < self.rate_limit_rate:
+            return "rate_limited", delay, seed
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            return "error", delay, seed
+        roll -= self.error_rate
+        if roll < self.malformed_rate:
+            return "malformed", delay, seed
+        return "ok", delay, seed
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.fake._lock:
+                self._send_json(200, dict(self.fake.stats))
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        try:
+            request = json.loads(body)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON body", "type": "invalid_request_error"}})
+            return
+        fake = self.fake
+        fake._count("requests")
+        outcome, delay, seed = fake._draw()
+        time.sleep(delay)
+        if outcome == "rate_limited":
+            fake._count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                            {"Retry-After": str(fake.retry_after)})
+            return
+        if outcome == "error":
+            fake._count("errors")
+            self._send_json(500, {"error": {"message": "Internal server error (fake)", "type": "server_error"}})
+            return
+
+        rng = random.Random(seed)
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        content = json.dumps(fake_recipe(prompt, rng))
+        if outcome == "malformed":
+            fake._count("malformed")
+            content = content[: len(content) // 2]  # Truncated mid-object.
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        model = request.get("model", "gpt-4")
+        if request.get("stream"):
+            fake._count("streamed")
+            self._stream(model, content)
+            return
+        self._send_json(200, {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, model, content):
+        """Send content as server-sent chat.completion.chunk events."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                     "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant"})
+        size = self.fake.chunk_size
+        for start in range(0, len(content), size):
+            time.sleep(self.fake.chunk_delay)
+            event({"content": content[start:start + size]})
+        event({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", default="fixed:0.05",
+                        help="fixed:S, uniform:LOW:HIGH, lognormal:MEDIAN:SIGMA or exp:MEAN (seconds)")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters per streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction with invalid JSON content")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    server = FakeOpenAIServer(
+        args.host, args.port, args.latency, args.chunk_delay, args.chunk_size,
+        args.error_rate, args.rate_limit_rate, args.malformed_rate, args.retry_after, args.seed,
+    )
+    print(f"fake OpenAI API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == '__main__':
+    main()
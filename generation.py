@@ -0,0 +1,207 @@
+import itertools
+import queue
+import threading
+import time
+
+from gi.repository import GLib
+
+from openai_integration import request_recipe, stream_recipe
+
+# Streamed text is flushed to the UI at most once per frame (~60 Hz).
+FRAME_INTERVAL_MS = 16
+
+class DeltaCoalescer:
+    """Batch streamed text so the main loop sees at most one update per frame.
+
+    push() may be called from any thread; on_flush(text) always runs on the
+    GTK main loop with everything received since the previous flush.
+    """
+
+    def __init__(self, on_flush, interval_ms=FRAME_INTERVAL_MS):
+        self.on_flush = on_flush
+        self.interval_ms = interval_ms
+        self._parts = []
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def push(self, text):
+        with self._lock:
+            self._parts.append(text)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        GLib.timeout_add(self.interval_ms, self._on_timeout)
+
+    def _on_timeout(self):
+        self.flush()
+        return False
+
+    def flush(self):
+        """Deliver any buffered text now. Must be called on the main loop."""
+        with self._lock:
+            text = "".join(self._parts)
+            self._parts = []
+            self._scheduled = False
+        if text:
+            self.on_flush(text)
+
+class GenerationRequest:
+    """A queued or running recipe generation that can be cancelled."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, prompt, callback, timeout, on_delta=None, use_cache=True):
+        self.id = next(self._ids)
+        self.prompt = prompt
+        self.callback = callback
+        self.timeout = timeout
+        self.use_cache = use_cache
+        self.deadline = None  # Set when a worker starts the request.
+        self._cancelled = threading.Event()
+        self.coalescer = None
+        if on_delta is not None:
+            self.coalescer = DeltaCoalescer(lambda text: self._on_text(on_delta, text))
+
+    def _on_text(self, on_delta, text):
+        if not self.cancelled:
+            on_delta(self, text)
+
+    def cancel(self):
+        """Drop this request; its callback will not be called."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        """True once the request has run for longer than its timeout."""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+class GenerationExecutor:
+    """Run recipe generations on a fixed pool of worker threads.
+
+    Requests wait in a bounded queue until a worker is free, so several
+    prompts can be in flight without ever blocking the GTK main loop.
+    Callbacks are invoked on the main loop via GLib.idle_add as
+    callback(request, formatted_text, recipe_data). Requests submitted with
+    on_delta are streamed, and on_delta(request, text) receives the raw
+    output as it arrives, coalesced to one call per frame.
+
+    Each request's timeout bounds its whole run, not just each read, so a
+    stream that keeps trickling in is still cut off at the deadline.
+    """
+
+    def __init__(self, workers=3, max_queued=16, timeout=90):
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._workers = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"generation-{i}", daemon=True)
+            thread.start()
+            self._workers.append(thread)
+
+    def submit(self, prompt, callback, timeout=None, on_delta=None, use_cache=True):
+        """Queue a prompt and return its GenerationRequest.
+
+        Pass use_cache=False to skip the response cache and get a new recipe.
+        Raises queue.Full if too many requests are already waiting.
+        """
+        request = GenerationRequest(prompt, callback, timeout or self.timeout, on_delta, use_cache)
+        with self._lock:
+            self._queue.put_nowait(request)
+            self._pending.add(request)
+        return request
+
+    def pending(self):
+        """Return the number of queued or running requests."""
+        with self._lock:
+            return len(self._pending)
+
+    def cancel_all(self):
+        """Cancel every queued or running request."""
+        with self._lock:
+            for request in self._pending:
+                request.cancel()
+
+    def shutdown(self):
+        """Cancel outstanding work and stop the workers without blocking.
+
+        Queued requests are dropped to make room for the workers' stop
+        markers. A worker that takes a request after this exits instead of
+        running it, so a marker lost to a racing submit() is harmless.
+        """
+        self._stopped.set()
+        self.cancel_all()
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                self._finish(request)
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def _work(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            if self._stopped.is_set():
+                self._finish(request)
+                return
+            if request.cancelled:
+                self._finish(request)
+                continue
+            request.deadline = time.monotonic() + request.timeout
+            scheduled = False
+            try:
+                try:
+                    formatted_text, recipe_data = self._generate(request)
+                except Exception as e:
+                    # Keep the worker alive and still answer the request.
+                    formatted_text, recipe_data = f"Error generating recipe: {e}", None
+                GLib.idle_add(self._deliver, request, formatted_text, recipe_data)
+                scheduled = True
+            finally:
+                if not scheduled:
+                    self._finish(request)
+
+    def _generate(self, request):
+        if request.coalescer is not None:
+            result = stream_recipe(
+                request.prompt,
+                request.coalescer.push,
+                timeout=request.timeout,
+                should_stop=lambda: request.cancelled or request.expired,
+                use_cache=request.use_cache,
+            )
+            if request.expired and not request.cancelled:
+                return f"Error generating recipe: timed out after {request.timeout:g} seconds", None
+            return result
+        # Without streaming the reply arrives in one read, which the HTTP
+        # read timeout already bounds.
+        return request_recipe(request.prompt, timeout=request.timeout, use_cache=request.use_cache)
+
+    def _deliver(self, request, formatted_text, recipe_data):
+        try:
+            if request.coalescer is not None:
+                # Hand over any trailing text before the final result.
+                request.coalescer.flush()
+        finally:
+            self._finish(request)
+        if not request.cancelled:
+            request.callback(request, formatted_text, recipe_data)
+        return False
+
+    def _finish(self, request):
+        with self._lock:
+            self._pending.discard(request)
@@ -2,21 +2,37 @@ import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, GLib
 
-import sqlite3
-
-from db import save_recipe, load_recipes
-from openai_integration import generate_recipe
+from db import save_recipe, load_recipe_page, get_duplicate_of, load_recipes_by_ids, build_shopping_list
+from detail_cache import RecipeDetailCache
+from generation import GenerationExecutor
+import metrics
+import openai_integration
+from recipe_list import RecipeListModel
+from search import SearchController
+from utils import format_shopping_list, parse_calorie_range
+
+import queue
+import threading
 
-from db import DB_FILE
+# Rows on either side of the selection whose details are prefetched.
+PREFETCH_RADIUS = 5
 
-import threading
+# Recipes listed by "More Like This".
+SIMILAR_COUNT = 10
 
 class RecipeApp(Gtk.Window):
-    def __init__(self):
+    def __init__(self, on_book_loaded=None):
         super().__init__(title="ChatGPT Recipe Book")
+        # Called once, after the Recipe Book is first populated (used by --profile-startup).
+        self.on_book_loaded = on_book_loaded
         self.set_default_size(800, 600)
         self.notebook = Gtk.Notebook()
         self.add(self.notebook)
+        self.generation_executor = GenerationExecutor()
+        self.stream_regions = {}
+        # Formatted text of the most recent successful generation (what Save stores).
+        self.generated_text = None
+        self.connect("destroy", self.on_destroy)
 
         # Tab 1: Recipe Generator
         self.generator_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -30,6 +46,13 @@ class RecipeApp(Gtk.Window):
         self.notebook.append_page(self.book_box, Gtk.Label(label="Recipe Book"))
         self.create_recipe_book_tab()
 
+        # Tab 3: Stats (only when instrumentation is enabled)
+        if metrics.ENABLED:
+            self.stats_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
+            self.stats_box.set_border_width(10)
+            self.notebook.append_page(self.stats_box, Gtk.Label(label="Stats"))
+            self.create_stats_tab()
+
     def create_generator_tab(self):
         self.output_view = Gtk.TextView()
         self.output_view.set_wrap_mode(Gtk.WrapMode.WORD)
@@ -48,6 +71,15 @@ class RecipeApp(Gtk.Window):
         self.generate_button.connect("clicked", self.on_generate_recipe)
         button_box.pack_start(self.generate_button, True, True, 0)
 
+        self.fresh_check = Gtk.CheckButton(label="Something new")
+        self.fresh_check.set_tooltip_text("Ignore cached results and generate a new recipe")
+        button_box.pack_start(self.fresh_check, False, False, 0)
+
+        self.cancel_button = Gtk.Button(label="Cancel")
+        self.cancel_button.set_sensitive(False)
+        self.cancel_button.connect("clicked", self.on_cancel_generation)
+        button_box.pack_start(self.cancel_button, True, True, 0)
+
         self.save_button = Gtk.Button(label="Save Recipe")
         self.save_button.connect("clicked", self.on_save_recipe)
         button_box.pack_start(self.save_button, True, True, 0)
@@ -65,9 +97,19 @@ class RecipeApp(Gtk.Window):
         search_box.pack_start(self.search_entry, True, True, 0)
         
         self.filter_cal_entry = Gtk.Entry()
-        self.filter_cal_entry.set_placeholder_text("Max calories (optional)")
+        self.filter_cal_entry.set_placeholder_text("Calories: max or min-max (optional)")
         self.filter_cal_entry.connect("changed", self.on_search_changed)
         search_box.pack_start(self.filter_cal_entry, True, True, 0)
+
+        # Sorting happens in SQL; the ids match db.SORT_ORDERS ("" = default order).
+        self.sort_combo = Gtk.ComboBoxText()
+        self.sort_combo.append("", "Best match")
+        self.sort_combo.append("name", "Name")
+        self.sort_combo.append("calories", "Calories (low to high)")
+        self.sort_combo.append("calories_desc", "Calories (high to low)")
+        self.sort_combo.set_active_id("")
+        self.sort_combo.connect("changed", self.on_search_changed)
+        search_box.pack_start(self.sort_combo, False, False, 0)
         
         vbox.pack_start(search_box, False, False, 0)
         
@@ -81,6 +123,10 @@ class RecipeApp(Gtk.Window):
         #   2: Recipe Name (str),
         #   3: Calories (int)
         self.recipe_liststore = Gtk.ListStore(bool, int, str, int)
+        # Rows are paged in from the database as the list is scrolled.
+        self.recipe_list = RecipeListModel(self.recipe_liststore)
+        self.search_controller = SearchController(self.fetch_first_page, self.on_search_results)
+        self.detail_cache = RecipeDetailCache()
         self.treeview = Gtk.TreeView(model=self.recipe_liststore)
         
         # Column 0: Checkbox
@@ -106,6 +152,7 @@ class RecipeApp(Gtk.Window):
         scrolled_list = Gtk.ScrolledWindow()
         scrolled_list.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
         scrolled_list.add(self.treeview)
+        scrolled_list.get_vadjustment().connect("value-changed", self.on_list_scrolled)
         
         hpaned.add1(scrolled_list)
         
@@ -125,12 +172,61 @@ class RecipeApp(Gtk.Window):
         delete_button = Gtk.Button(label="Delete Selected")
         delete_button.connect("clicked", self.on_delete_selected)
         vbox.pack_start(delete_button, False, False, 0)
+
+        # --- Shopping List Button ---
+        shopping_button = Gtk.Button(label="Build Shopping List")
+        shopping_button.connect("clicked", self.on_build_shopping_list)
+        vbox.pack_start(shopping_button, False, False, 0)
+
+        # --- More Like This Button ---
+        similar_button = Gtk.Button(label="More Like This")
+        similar_button.connect("clicked", self.on_more_like_this)
+        vbox.pack_start(similar_button, False, False, 0)
         
         # Add the entire layout to the book_box container.
         self.book_box.pack_start(vbox, True, True, 0)
-        
-        # Load recipes initially.
-        self.refresh_recipes()
+
+        # Recipes are loaded in the background once the window has drawn its
+        # first frame (see on_first_frame), so a large book doesn't delay startup.
+        self.first_frame_handler = self.connect_after("draw", self.on_first_frame)
+
+    def create_stats_tab(self):
+        self.stats_view = Gtk.TextView()
+        self.stats_view.set_editable(False)
+        self.stats_view.set_monospace(True)
+        scrolled_stats = Gtk.ScrolledWindow()
+        scrolled_stats.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        scrolled_stats.add(self.stats_view)
+        self.stats_box.pack_start(scrolled_stats, True, True, 0)
+
+        refresh_button = Gtk.Button(label="Refresh")
+        refresh_button.connect("clicked", self.on_refresh_stats)
+        self.stats_box.pack_start(refresh_button, False, False, 0)
+
+    def on_refresh_stats(self, widget):
+        snapshot = metrics.registry.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:<36} {value:>12.4g}")
+        lines.append("")
+        lines.append(f"{'timing (ms)':<36} {'count':>8} {'p50':>8} {'p99':>8} {'max':>8}")
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            lines.append(
+                f"{name:<36} {histogram['count']:>8} {histogram['p50'] * 1000:>8.1f} "
+                f"{histogram['p99'] * 1000:>8.1f} {histogram['max'] * 1000:>8.1f}"
+            )
+        # Recent OpenAI calls are tracked even when metrics are off.
+        lines.append("")
+        for name, value in openai_integration.client.stats().items():
+            lines.append(f"openai.client.{name:<22} {value:>12.4g}")
+        self.stats_view.get_buffer().set_text("\n".join(lines))
+
+    def on_first_frame(self, widget, cr):
+        self.disconnect(self.first_frame_handler)
+        self.search_controller.request(self.search_filters(), delay_ms=0)
+        # Warm up the OpenAI client off the main thread before the first generation.
+        threading.Thread(target=openai_integration.preload, daemon=True).start()
+        return False
 
 
     def on_generate_recipe(self, widget):
@@ -138,11 +234,56 @@ class RecipeApp(Gtk.Window):
         if not prompt:
             self.show_message("Please enter a recipe prompt or modification instruction.")
             return
-        self.generate_button.set_sensitive(False)
-        self.output_buffer.insert(self.output_buffer.get_end_iter(), "\nGenerating recipe...\n")
+        try:
+            request = self.generation_executor.submit(
+                prompt, self.on_generation_done, on_delta=self.on_generation_delta,
+                use_cache=not self.fresh_check.get_active())
+        except queue.Full:
+            self.show_message("Too many recipes are being generated. Please wait.")
+            return
+        self.cancel_button.set_sensitive(True)
+        buffer = self.output_buffer
+        buffer.insert(buffer.get_end_iter(), f"\nGenerating recipe for \"{prompt}\"...\n\n")
+        # Streamed text for this request goes between two marks placed before
+        # the trailing newline, so concurrent requests never interleave.
+        region = buffer.get_end_iter()
+        region.backward_char()
+        start_mark = buffer.create_mark(None, region, True)
+        end_mark = buffer.create_mark(None, region, False)
+        self.stream_regions[request.id] = (start_mark, end_mark)
+
+    def on_generation_delta(self, request, text):
+        start_mark, end_mark = self.stream_regions[request.id]
+        self.output_buffer.insert(self.output_buffer.get_iter_at_mark(end_mark), text)
+
+    def on_generation_done(self, request, text, recipe_data):
+        buffer = self.output_buffer
+        start_mark, end_mark = self.stream_regions.pop(request.id)
+        # Replace the raw streamed JSON with the formatted recipe.
+        start = buffer.get_iter_at_mark(start_mark)
+        end = buffer.get_iter_at_mark(end_mark)
+        buffer.delete(start, end)
+        buffer.insert(buffer.get_iter_at_mark(start_mark), text)
+        buffer.delete_mark(start_mark)
+        buffer.delete_mark(end_mark)
+        self.cancel_button.set_sensitive(self.generation_executor.pending() > 0)
+        self.generated_recipe = recipe_data
+        self.generated_text = text if recipe_data else None
 
-        from openai_integration import generate_recipe
-        generate_recipe(prompt, self.update_output)
+    def on_cancel_generation(self, widget):
+        self.generation_executor.cancel_all()
+        for start_mark, end_mark in self.stream_regions.values():
+            self.output_buffer.delete_mark(start_mark)
+            self.output_buffer.delete_mark(end_mark)
+        self.stream_regions.clear()
+        self.cancel_button.set_sensitive(False)
+        self.output_buffer.insert(self.output_buffer.get_end_iter(), "\nGeneration cancelled.\n")
+
+    def on_destroy(self, widget):
+        self.generation_executor.shutdown()
+        self.search_controller.shutdown()
+        self.detail_cache.shutdown()
+        openai_integration.client.close()
 
 
     def generate_recipe_api(self, prompt):
@@ -191,16 +332,9 @@ class RecipeApp(Gtk.Window):
 
         GLib.idle_add(self.update_output, formatted_text)
 
-    def update_output(self, text, recipe_data):
-        self.output_buffer.insert(self.output_buffer.get_end_iter(), text + "\n")
-        self.generate_button.set_sensitive(True)
-        self.generated_recipe = recipe_data
-
-
     def on_save_recipe(self, widget):
-        # Get the current recipe text from the output buffer.
-        start, end = self.output_buffer.get_bounds()
-        recipe_text = self.output_buffer.get_text(start, end, True).strip()
+        # Save only the latest generated recipe, not the whole output log.
+        recipe_text = (self.generated_text or "").strip()
         if not recipe_text:
             self.show_message("No recipe available to save.")
             return
@@ -249,65 +383,153 @@ class RecipeApp(Gtk.Window):
         dialog.destroy()
 
     def save_recipe_to_db(self, name, ingredients, recipe_text, calories):
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("INSERT INTO recipes (name, ingredients, recipe_text, calories) VALUES (?, ?, ?, ?)",
-                  (name, ingredients, recipe_text, calories))
-        conn.commit()
-        conn.close()
-        self.show_message("Recipe saved successfully!")
-        self.refresh_recipes()
-
-    def refresh_recipes(self):
-        self.recipe_liststore.clear()
-        from db import load_recipes as db_refresh_recipes  # Import with a different name.
-        search_text = self.search_entry.get_text().strip()
-        recipes = db_refresh_recipes(search_text)
-        for recipe in recipes:
-            # Append each recipe. For our list store, we assume a row: [False, id, name, calories].
-            self.recipe_liststore.append([False, recipe[0], recipe[1], recipe[2]])
+        recipe_id = save_recipe(name, ingredients, recipe_text, calories)
+        duplicate = get_duplicate_of(recipe_id)
+        if duplicate:
+            self.show_message(f"Recipe saved. It looks like a near-duplicate of recipe "
+                              f"#{duplicate[0]} ({duplicate[1]:.0%} similar).")
+        else:
+            self.show_message("Recipe saved successfully!")
+        self.recipe_list.invalidate()
+
+    def search_filters(self):
+        """Return the current search box, calorie filter and sort as load_recipe_page arguments."""
+        min_cal, max_cal = parse_calorie_range(self.filter_cal_entry.get_text())
+        return {
+            "search_text": self.search_entry.get_text().strip(),
+            "min_cal": min_cal,
+            "max_cal": max_cal,
+            "order_by": self.sort_combo.get_active_id() or None,
+        }
+
+    def on_list_scrolled(self, adjustment):
+        # Fetch the next page once the user is within a screenful of the end.
+        remaining = adjustment.get_upper() - (adjustment.get_value() + adjustment.get_page_size())
+        if remaining < adjustment.get_page_size():
+            page = self.recipe_list.next_page()
+            if page is not None:
+                # Read on the search thread; the rows arrive in on_page_loaded.
+                self.search_controller.fetch_more(self.recipe_list.fetch, self.on_page_loaded, *page)
+
+    def on_page_loaded(self, args, rows):
+        filters, index = args
+        self.recipe_list.add_page(filters, index, rows)
 
     def on_search_changed(self, widget):
-        self.refresh_recipes()
+        # Debounced; the query runs in the background and results arrive in on_search_results.
+        self.search_controller.request(self.search_filters())
+
+    def fetch_first_page(self, filters):
+        # Runs on the search thread.
+        return load_recipe_page(**filters, limit=self.recipe_list.page_size)
+
+    def on_search_results(self, args, rows):
+        (filters,) = args
+        self.recipe_list.set_rows(filters, rows)
+        if self.on_book_loaded is not None:
+            callback, self.on_book_loaded = self.on_book_loaded, None
+            callback()
 
     def on_recipe_selected(self, selection):
         model, treeiter = selection.get_selected()
         if treeiter is None:
             return
         recipe_id = model[treeiter][1]  # Column 1 holds the recipe ID.
-        # Retrieve full recipe details.
-        import sqlite3
-        from db import DB_FILE
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT recipe_text FROM recipes WHERE id = ?", (recipe_id,))
-        row = c.fetchone()
-        conn.close()
-        if row:
+        # Retrieve full recipe details, from the cache when possible.
+        recipe_text = self.detail_cache.get(recipe_id)
+        if recipe_text is not None:
             detail_buffer = self.detail_view.get_buffer()
-            detail_buffer.set_text(row[0])
+            detail_buffer.set_text(recipe_text)
+        # Warm the cache for the rows around the selection.
+        index = model.get_path(treeiter).get_indices()[0]
+        start = max(0, index - PREFETCH_RADIUS)
+        end = min(len(model), index + PREFETCH_RADIUS + 1)
+        self.detail_cache.prefetch([model[i][1] for i in range(start, end) if i != index])
 
 
+    def on_more_like_this(self, widget):
+        model, treeiter = self.treeview.get_selection().get_selected()
+        if treeiter is None:
+            self.show_message("Select a recipe to find similar ones.")
+            return
+        recipe_id, name = model[treeiter][1], model[treeiter][2]
+        threading.Thread(target=self.find_similar, args=(recipe_id, name), daemon=True).start()
+
+    def find_similar(self, recipe_id, name):
+        # NumPy/SciPy load (and the index is opened) off the main thread on first use.
+        import similar
+        matches = similar.get_index().most_similar(recipe_id, k=SIMILAR_COUNT)
+        scores = dict(matches)
+        rows = [(row_id, row_name, calories, scores[row_id])
+                for row_id, row_name, calories in load_recipes_by_ids([i for i, _ in matches])]
+        GLib.idle_add(self.show_similar, name, rows)
+
+    def show_similar(self, name, rows):
+        if not rows:
+            self.show_message(f"No recipes similar to {name} were found.")
+            return False
+        dialog = Gtk.Dialog(title=f"More like {name}", transient_for=self, flags=0)
+        dialog.add_buttons(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+        dialog.set_default_size(420, 320)
+        store = Gtk.ListStore(int, str, int, str)
+        for row_id, row_name, calories, score in rows:
+            store.append([row_id, row_name, calories, f"{score:.0%}"])
+        view = Gtk.TreeView(model=store)
+        for title, column in (("Recipe Name", 1), ("Calories", 2), ("Similarity", 3)):
+            view.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column))
+        view.connect("row-activated", self.on_similar_activated)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(view)
+        dialog.get_content_area().pack_start(scrolled, True, True, 0)
+        dialog.show_all()
+        dialog.run()
+        dialog.destroy()
+        return False
+
+    def on_similar_activated(self, view, path, column):
+        # Show the activated recipe in the detail pane.
+        recipe_text = self.detail_cache.get(view.get_model()[path][0])
+        if recipe_text is not None:
+            self.detail_view.get_buffer().set_text(recipe_text)
+
     def on_toggle_selected(self, widget, path):
         # Toggle the boolean value in the list store at the given path.
         current_value = self.recipe_liststore[path][0]
         self.recipe_liststore[path][0] = not current_value
 
+    def checked_recipe_ids(self):
+        # IDs of the rows whose checkbox is checked.
+        return [row[1] for row in self.recipe_liststore if row[0]]
+
     def on_delete_selected(self, widget):
-        from db import delete_recipe  # Ensure delete_recipe is defined in db.py.
-        to_delete = []
-        # Iterate over the list store to collect IDs of selected recipes.
-        for row in self.recipe_liststore:
-            if row[0]:  # If checkbox is checked.
-                recipe_id = row[1]
-                to_delete.append(recipe_id)
-        # Delete each selected recipe from the database.
-        for recipe_id in to_delete:
-            delete_recipe(recipe_id)
+        from db import delete_recipes
+        to_delete = self.checked_recipe_ids()
+        # Delete all selected recipes from the database in one transaction.
+        delete_recipes(to_delete)
         # Refresh the list.
-        self.refresh_recipes()
+        self.recipe_list.invalidate()
         self.show_message("Selected recipes deleted.")
 
+    def on_build_shopping_list(self, widget):
+        recipe_ids = self.checked_recipe_ids()
+        if not recipe_ids:
+            self.show_message("Check the recipes to build a shopping list for.")
+            return
+        # Quantities were parsed when the recipes were saved, so this is one query.
+        items = build_shopping_list(recipe_ids)
+        dialog = Gtk.Dialog(title=f"Shopping list for {len(recipe_ids)} recipes", transient_for=self, flags=0)
+        dialog.add_buttons(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+        dialog.set_default_size(420, 480)
+        view = Gtk.TextView()
+        view.set_editable(False)
+        view.get_buffer().set_text(format_shopping_list(items))
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(view)
+        dialog.get_content_area().pack_start(scrolled, True, True, 0)
+        dialog.show_all()
+        dialog.run()
+        dialog.destroy()
+
     def show_message(self, message):
         dialog = Gtk.MessageDialog(
             transient_for=self,
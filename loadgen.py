@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Load-test the recipe book API (server.py) and report throughput and tail latency.
+
+Each of --connections clients keeps one HTTP/1.1 connection alive and sends
+requests back to back for --duration seconds. Requests are drawn from
+--mix: "search" types prefixes of the benchmark's keystroke queries,
+"fetch" reads a random recipe, "stream" streams a whole search, "save"
+stores a synthetic recipe and "generate" asks for a (cached) generation.
+Results are printed as JSON: requests/sec plus p50/p99/max latency overall
+and per kind.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+from benchmark import KEYSTROKE_QUERIES, latency_summary, synthetic_recipe
+
+DEFAULT_MIX = "search=70,fetch=25,stream=5"
+
+def parse_mix(spec):
+    """Turn "search=70,fetch=30" into ([kinds], [weights])."""
+    kinds, weights = [], []
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("search", "fetch", "stream", "save", "generate"):
+            raise ValueError(f"unknown request kind: {kind!r}")
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+class Connection:
+    """A minimal keep-alive HTTP/1.1 client connection."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        """Send a request and return (status, body bytes)."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+        try:
+            return await self._read_response()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.close()
+            raise
+
+    async def _read_response(self):
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                parts.append(chunk[:-2])
+            body = b"".join(parts)
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, body
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+def build_request(kind, rng, recipe_ids):
+    if kind == "search":
+        query = rng.choice(KEYSTROKE_QUERIES)
+        prefix = query[:rng.randint(1, len(query))]
+        return "GET", f"/recipes?q={quote(prefix)}&limit=50", None
+    if kind == "fetch":
+        return "GET", f"/recipes/{rng.choice(recipe_ids) if recipe_ids else 1}", None
+    if kind == "stream":
+        return "GET", f"/recipes?stream=1&q={quote(rng.choice(KEYSTROKE_QUERIES))}", None
+    if kind == "save":
+        name, ingredients, recipe_text, calories = synthetic_recipe(rng)
+        return "POST", "/recipes", {"name": name, "ingredients": ingredients,
+                                    "recipe_text": recipe_text, "calories": calories}
+    return "POST", "/generate", {"prompt": f"load test recipe {rng.randint(1, 20)}"}
+
+async def client(host, port, kinds, weights, recipe_ids, deadline, seed, samples, statuses):
+    rng = random.Random(seed)
+    conn = Connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            method, path, payload = build_request(kind, rng, recipe_ids)
+            started = time.perf_counter()
+            try:
+                status, _ = await conn.request(method, path, payload)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status = "error"
+            samples.setdefault(kind, []).append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    finally:
+        await conn.close()
+
+async def run(url, connections, duration, mix, seed):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    kinds, weights = parse_mix(mix)
+    probe = Connection(host, port)
+    status, body = await probe.request("GET", "/recipes?limit=1000")
+    await probe.close()
+    if status != 200:
+        raise SystemExit(f"server answered {status} to the initial listing")
+    recipe_ids = [recipe["id"] for recipe in json.loads(body)["recipes"]]
+
+    samples, statuses = {}, {}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(client(host, port, kinds, weights, recipe_ids, deadline, seed + i,
+                                  samples, statuses)
+                           for i in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    everything = [sample for kind_samples in samples.values() for sample in kind_samples]
+    report = {
+        "url": url,
+        "connections": connections,
+        "duration_seconds": elapsed,
+        "requests": len(everything),
+        "requests_per_sec": len(everything) / elapsed,
+        "statuses": statuses,
+    }
+    if everything:
+        report["latency"] = dict(latency_summary(everything), max_ms=max(everything) * 1000)
+        report["by_kind"] = {kind: dict(latency_summary(kind_samples), max_ms=max(kind_samples) * 1000)
+                             for kind, kind_samples in samples.items()}
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent keep-alive clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="weighted request kinds: search, fetch, stream, save, generate "
+                             f"(default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args.url, args.connections, args.duration, args.mix, args.seed))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    errors = sum(count for status, count in report["statuses"].items() if not status.startswith("2"))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,105 @@
 #!/usr/bin/env python3
-from dotenv import load_dotenv
-load_dotenv()
+import argparse
+import sys
+import time
+from contextlib import contextmanager
 
-from db import init_db
-from gui import RecipeApp
-import gi
+class StartupProfile:
+    """Record how long each startup phase takes, for --profile-startup."""
 
-gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        yield
+        ended = time.perf_counter()
+        self.phases.append((name, ended - started, ended - self.started))
+
+    def mark(self, name):
+        """Record a milestone that has no duration of its own."""
+        self.phases.append((name, None, time.perf_counter() - self.started))
+
+    def report(self, out=sys.stderr):
+        if not self.enabled:
+            return
+        print(f"  {'startup phase':<28} {'took':>11} {'at':>11}", file=out)
+        for name, duration, at in self.phases:
+            took = f"{duration * 1000:8.1f} ms" if duration is not None else " " * 11
+            print(f"  {name:<28} {took} {at * 1000:8.1f} ms", file=out)
 
 def main():
-    init_db()
-    app = RecipeApp()
+    parser = argparse.ArgumentParser(description="ChatGPT Recipe Book")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print an import/init time breakdown once the window is up")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="collect timings and write them to FILE on exit (.prom for Prometheus text, else JSON)")
+    parser.add_argument("--db", metavar="PATH",
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    parser.add_argument("--backup-dir", metavar="DIR",
+                        help="take periodic snapshots of the database into DIR while the app runs")
+    parser.add_argument("--backup-interval", type=float, default=3600, metavar="SECONDS",
+                        help="seconds between snapshots (default: 3600)")
+    parser.add_argument("--backup-keep", type=int, default=7, metavar="N",
+                        help="snapshots to keep (default: 7)")
+    args = parser.parse_args()
+    if args.metrics:
+        # Must happen before the instrumented modules are imported below.
+        import os
+        import metrics
+        metrics.enable()
+        os.environ["RECIPE_METRICS_FILE"] = args.metrics
+    profile = StartupProfile(args.profile_startup)
+
+    with profile.phase("import dotenv + load .env"):
+        from dotenv import load_dotenv
+        load_dotenv()
+    with profile.phase("import db"):
+        import db
+        from db import init_db, close_db
+        if args.db:
+            db.DB_FILE = args.db
+    with profile.phase("import gtk"):
+        import gi
+        gi.require_version("Gtk", "3.0")
+        from gi.repository import Gtk
+    with profile.phase("import gui"):
+        from gui import RecipeApp
+    with profile.phase("init_db"):
+        init_db()
+    scheduler = None
+    if args.backup_dir:
+        from backup import BackupScheduler
+
+        def on_backup_done(path, error):
+            if error is not None:
+                print(f"Snapshot failed: {error}", file=sys.stderr)
+
+        scheduler = BackupScheduler(args.backup_dir, args.backup_interval, args.backup_keep,
+                                    on_done=on_backup_done).start()
+
+    def on_book_loaded():
+        profile.mark("recipe book populated")
+        profile.report()
+
+    def on_first_frame(widget, cr):
+        widget.disconnect(first_frame_handler)
+        profile.mark("first frame drawn")
+        return False
+
+    with profile.phase("build window"):
+        app = RecipeApp(on_book_loaded=on_book_loaded if args.profile_startup else None)
     app.connect("destroy", Gtk.main_quit)
-    app.show_all()
+    first_frame_handler = app.connect_after("draw", on_first_frame)
+    with profile.phase("show window"):
+        app.show_all()
     Gtk.main()
+    if scheduler is not None:
+        scheduler.stop()
+    close_db()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Plan meals that hit a daily calorie target from the saved recipes.
+
+Candidate calories are loaded once into a NumPy array. For each day the
+planner draws a batch of random combinations for all meals but the last,
+then picks the last meal by binary search over the sorted calories for
+whatever is left of the target. Every combination in the batch is scored
+at once, and the closest one that repeats no recipe already in the plan
+wins, so a week is a handful of array operations rather than a search
+over recipes in Python.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import db
+import metrics
+
+# Random combinations scored per day. More gets closer to the target at
+# the cost of a larger (samples x meals) array.
+DEFAULT_SAMPLES = 4096
+
+def load_candidates(include=(), exclude=(), min_cal=None, max_cal=None):
+    """Return (ids, calories) arrays for recipes matching the filters, sorted by calories."""
+    rows = db.load_calorie_candidates(include, exclude, min_cal, max_cal)
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    data = np.array(rows, dtype=np.int64)
+    order = np.argsort(data[:, 1], kind="stable")
+    return data[order, 0], data[order, 1]
+
+def _best_day(calories, free, meals, target, samples, rng):
+    """Return (indices, total) of the best combination of free recipes for one day.
+
+    free holds the indices of recipes not yet in the plan; since calories
+    is sorted, so are calories[free].
+    """
+    available = calories[free]
+    count = len(free)
+    picks = rng.integers(0, count, size=(samples, meals))
+    if meals > 1:
+        # Choose the last meal to fill what the others leave of the target:
+        # the neighbours either side of the insertion point are the closest.
+        remaining = target - available[picks[:, :-1]].sum(axis=1)
+        upper = np.searchsorted(available, remaining).clip(max=count - 1)
+        lower = (upper - 1).clip(min=0)
+        closer = np.abs(available[lower] - remaining) < np.abs(available[upper] - remaining)
+        picks[:, -1] = np.where(closer, lower, upper)
+    totals = available[picks].sum(axis=1)
+    error = np.abs(totals - target).astype(np.float64)
+    # Reject combinations that use a recipe twice.
+    ordered = np.sort(picks, axis=1)
+    error[(np.diff(ordered, axis=1) == 0).any(axis=1)] = np.inf
+    best = int(np.argmin(error))
+    if not np.isfinite(error[best]):
+        # Only possible when almost every pick collides; fall back to distinct random recipes.
+        return rng.choice(free, size=meals, replace=False), None
+    return free[picks[best]], int(totals[best])
+
+@metrics.timed("meal_planner.plan_seconds")
+def plan_meals(days=7, meals=3, target=2000, include=(), exclude=(), min_cal=None, max_cal=None,
+               samples=DEFAULT_SAMPLES, seed=None):
+    """Return a list of days, each {"total": calories, "recipes": [(id, name, calories), ...]}.
+
+    No recipe appears twice in the plan. Raises ValueError if too few
+    recipes match the filters to fill it.
+    """
+    if days < 1 or meals < 1:
+        raise ValueError("days and meals must be at least 1")
+    ids, calories = load_candidates(include, exclude, min_cal, max_cal)
+    if len(ids) < days * meals:
+        raise ValueError(f"only {len(ids)} recipes match; a plan needs {days * meals}")
+    rng = np.random.default_rng(seed)
+    used = np.zeros(len(ids), dtype=bool)
+    chosen = []
+    for _ in range(days):
+        picks, total = _best_day(calories, np.flatnonzero(~used), meals, target, samples, rng)
+        if total is None:
+            total = int(calories[picks].sum())
+        used[picks] = True
+        chosen.append((ids[picks].tolist(), total))
+
+    names = {row[0]: row for row in db.load_recipes_by_ids(
+        recipe_id for day_ids, _ in chosen for recipe_id in day_ids)}
+    return [{"total": total, "recipes": [names[recipe_id] for recipe_id in day_ids]}
+            for day_ids, total in chosen]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=db.DB_FILE,
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--meals", type=int, default=3, help="recipes per day")
+    parser.add_argument("--calories", type=int, default=2000, help="daily calorie target")
+    parser.add_argument("--include", action="append", default=[], metavar="INGREDIENT",
+                        help="only use recipes with this ingredient (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="INGREDIENT",
+                        help="never use recipes with this ingredient (repeatable)")
+    parser.add_argument("--min-meal", type=int, help="minimum calories of any one recipe")
+    parser.add_argument("--max-meal", type=int, help="maximum calories of any one recipe")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES,
+                        help="combinations scored per day (default: %(default)s)")
+    parser.add_argument("--seed", type=int, help="random seed for a repeatable plan")
+    parser.add_argument("--json", action="store_true", help="print the plan as JSON")
+    args = parser.parse_args(argv)
+
+    db.DB_FILE = args.db
+    db.init_db()
+    try:
+        plan = plan_meals(args.days, args.meals, args.calories, args.include, args.exclude,
+                          args.min_meal, args.max_meal, args.samples, args.seed)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db.close_db()
+    if args.json:
+        print(json.dumps([{"total": day["total"],
+                           "recipes": [{"id": i, "name": name, "calories": cal}
+                                       for i, name, cal in day["recipes"]]}
+                          for day in plan], indent=2))
+    else:
+        for number, day in enumerate(plan, 1):
+            print(f"Day {number}: {day['total']} kcal")
+            for recipe_id, name, cal in day["recipes"]:
+                print(f"  {recipe_id:>8}  {cal:>5}  {name}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+# Instrumentation is off unless RECIPE_METRICS is set (or enable() is called
+# before the instrumented modules are imported). When off, timed() leaves
+# functions undecorated and timer() hands back a shared no-op, so the hot
+# paths pay a single global lookup.
+ENABLED = os.environ.get("RECIPE_METRICS", "") not in ("", "0")
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" values).
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-1K-token prices in USD used to estimate the cost of a request.
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+}
+
+class Histogram:
+    """Fixed-bucket histogram of durations (or any non-negative values)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+class Registry:
+    """Thread-safe store of named counters and histograms."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def to_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = _prometheus_name(name)
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                metric = _prometheus_name(name)
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.sum}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+registry = Registry()
+
+def _prometheus_name(name):
+    return "recipe_book_" + name.replace(".", "_").replace("-", "_")
+
+def enable():
+    """Turn instrumentation on. Call before importing the instrumented modules."""
+    global ENABLED
+    ENABLED = True
+
+def inc(name, value=1):
+    """Add value to a counter."""
+    if ENABLED:
+        registry.inc(name, value)
+
+def observe(name, value):
+    """Record a value (usually seconds) in a histogram."""
+    if ENABLED:
+        registry.observe(name, value)
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name):
+    """Context manager recording the duration of its block in histogram name."""
+    return _Timer(name) if ENABLED else _NULL_TIMER
+
+def timed(name):
+    """Decorator recording each call's duration in histogram name.
+
+    Whether to instrument is decided when the function is decorated, so a
+    disabled build returns the function itself.
+    """
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def record_usage(model, usage):
+    """Count the tokens in an API response's usage and its estimated cost."""
+    if not ENABLED or usage is None:
+        return
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    registry.inc("openai.prompt_tokens", prompt_tokens)
+    registry.inc("openai.completion_tokens", completion_tokens)
+    prompt_price, completion_price = MODEL_PRICES.get(model, MODEL_PRICES["gpt-4"])
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    registry.inc("openai.estimated_cost_usd", cost)
+    registry.observe("openai.request_cost_usd", cost)
+
+def export(path):
+    """Write all metrics to path: Prometheus text for .prom/.txt, JSON otherwise."""
+    if path.endswith((".prom", ".txt")):
+        data = registry.to_prometheus()
+    else:
+        data = json.dumps(registry.snapshot(), indent=2) + "\n"
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _export_at_exit():
+    path = os.environ.get("RECIPE_METRICS_FILE")
+    if ENABLED and path:
+        export(path)
+
+atexit.register(_export_at_exit)
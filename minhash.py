@@ -0,0 +1,140 @@
+import hashlib
+import random
+import re
+from array import array
+
+from utils import normalize_ingredient, split_ingredients
+
+# 64 hash functions split into 16 bands of 4 rows. Two recipes share at least
+# one LSH bucket with probability 1 - (1 - s**4)**16 for Jaccard similarity s:
+# about 0.65 at s = 0.5, 0.99 at s = 0.7 and above.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Instructions are compared as overlapping runs of this many words.
+SHINGLE_WORDS = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1)  # Fixed, so signatures are comparable across runs.
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_WORD = re.compile(r"[a-z0-9]+")
+
+def shingles(ingredients, recipe_text):
+    """Return the set of features compared between recipes.
+
+    Normalized ingredient names and word shingles of the instructions are
+    kept apart by prefix, so an ingredient never matches an instruction word.
+    """
+    features = {"i:" + name for name in map(normalize_ingredient, split_ingredients(ingredients))
+                if name}
+    words = _WORD.findall((recipe_text or "").lower())
+    if len(words) < SHINGLE_WORDS:
+        if words:
+            features.add("t:" + " ".join(words))
+    else:
+        for i in range(len(words) - SHINGLE_WORDS + 1):
+            features.add("t:" + " ".join(words[i:i + SHINGLE_WORDS]))
+    return features
+
+def _hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+# Feature hashes processed per NumPy pass in signatures(); each pass holds a
+# few (NUM_PERM x this) uint64 arrays.
+_BATCH_HASHES = 8192
+
+def _mod_prime(np, x):
+    """Reduce uint64 values modulo _PRIME, which is 2**61 - 1 (a Mersenne prime)."""
+    x = (x & np.uint64(_PRIME)) + (x >> np.uint64(61))
+    # x - _PRIME wraps around to a huge value unless x >= _PRIME.
+    return np.minimum(x, x - np.uint64(_PRIME))
+
+def _split(np, values):
+    values = np.asarray(values, dtype=np.uint64)
+    return values >> np.uint64(32), values & np.uint64(0xFFFFFFFF)
+
+_permutation_arrays = None
+
+def _permute(np, hashes):
+    """Return the (NUM_PERM x len(hashes)) array of (a * h + b) mod _PRIME.
+
+    The full product does not fit in 64 bits, so it is built exactly from
+    32-bit halves: with a * h = hi * 2**64 + middle * 2**32 + lo and
+    2**61 = 1 (mod _PRIME), 2**64 becomes 8 and middle * 2**32 folds into
+    middle >> 29 plus its low bits shifted up. The result matches plain
+    integer arithmetic, so stored signatures stay comparable.
+    """
+    global _permutation_arrays
+    if _permutation_arrays is None:
+        a_hi, a_lo = _split(np, [a for a, _ in _PERMUTATIONS])
+        b = np.array([b for _, b in _PERMUTATIONS], dtype=np.uint64)
+        _permutation_arrays = a_hi[:, None], a_lo[:, None], b[:, None]
+    a_hi, a_lo, b = _permutation_arrays
+    h_hi, h_lo = _split(np, hashes)
+    middle = a_hi * h_lo + a_lo * h_hi
+    product = (((a_hi * h_hi) << np.uint64(3)) + (middle >> np.uint64(29))
+               + ((middle & np.uint64(0x1FFFFFFF)) << np.uint64(32))
+               + _mod_prime(np, a_lo * h_lo))
+    return _mod_prime(np, _mod_prime(np, product) + b)
+
+def signatures(recipes):
+    """Yield the signature of each (ingredients, recipe_text) pair, or None if it is empty.
+
+    Hashes from many recipes go through each NumPy pass together, so a
+    batch costs a few array operations rather than one per recipe.
+    """
+    # NumPy is imported on first use so it stays off the GUI's startup path.
+    import numpy as np
+    pending = []
+    hashes = []
+
+    def flush():
+        if hashes:
+            offsets = np.cumsum([0] + [count for count in pending if count][:-1])
+            minima = iter(np.minimum.reduceat(_permute(np, hashes), offsets, axis=1).T.tolist())
+        for count in pending:
+            yield next(minima) if count else None
+        pending.clear()
+        hashes.clear()
+
+    for ingredients, recipe_text in recipes:
+        features = [_hash(feature) % _PRIME for feature in shingles(ingredients, recipe_text)]
+        pending.append(len(features))
+        hashes.extend(features)
+        if len(hashes) >= _BATCH_HASHES:
+            yield from flush()
+    yield from flush()
+
+def signature(ingredients, recipe_text):
+    """Return the MinHash signature (NUM_PERM ints) of a recipe, or None if it is empty."""
+    return next(signatures([(ingredients, recipe_text)]))
+
+def pack(sig):
+    """Serialize a signature for the recipe_minhash table."""
+    return array("Q", sig).tobytes()
+
+def unpack(blob):
+    return array("Q", blob)
+
+def band_keys(sig):
+    """Return (band, bucket) pairs placing the signature in one bucket per band."""
+    keys = []
+    for band in range(BANDS):
+        rows = array("Q", sig[band * ROWS:(band + 1) * ROWS]).tobytes()
+        digest = hashlib.blake2b(rows, digest_size=8).digest()
+        keys.append((band, int.from_bytes(digest, "little", signed=True)))
+    return keys
+
+def similarity(sig_a, sig_b):
+    """Estimate the Jaccard similarity of two recipes from their signatures."""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+def similarities(sig, blobs):
+    """Estimate the Jaccard similarity of a recipe to each packed signature in blobs.
+
+    Returns a NumPy array with one score per blob, compared all at once.
+    """
+    import numpy as np
+    candidates = np.frombuffer(b"".join(blobs), dtype=np.uint64).reshape(-1, NUM_PERM)
+    return (candidates == np.asarray(sig, dtype=np.uint64)).mean(axis=1)
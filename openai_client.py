@@ -0,0 +1,215 @@
+"""A shared, pooled HTTP session for OpenAI requests, with request coalescing.
+
+The openai package normally opens one requests.Session per thread and
+replaces it every few minutes, so a pool of generation threads keeps
+re-handshaking. OpenAIClient installs a single keep-alive session (sized to
+max_concurrency connections) as openai.requestssession and applies default
+connect/read timeouts. openai still calls close() on each thread's session
+when it would have replaced it, so the shared session ignores close(); its
+connections are only closed by OpenAIClient.close().
+
+Requests go through OpenAIClient.call(). Identical requests already in
+flight are coalesced: later callers wait for the first one's upstream call
+instead of making their own, and streamed text is fanned out to every
+caller's on_delta as it arrives. Each call's time spent queued for a
+connection slot and its total latency are kept in `history` and reported
+by stats() and metrics.
+"""
+import threading
+import time
+from collections import deque
+
+import metrics
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_MAX_CONCURRENCY = 8
+
+def make_session(pool_size):
+    """Return a requests.Session that keeps up to pool_size connections per host alive.
+
+    close() does nothing, since openai calls it on the session it shares
+    between threads; call shutdown() to actually close the connections.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class SharedSession(requests.Session):
+        def close(self):
+            pass
+
+        def shutdown(self):
+            super().close()
+
+    session = SharedSession()
+    # Retry connection failures only; API errors are left to the callers.
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _ignore(text):
+    pass
+
+def _never():
+    return False
+
+class _Flight:
+    """One upstream call shared by every caller that asked for the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._parts = []
+        self._listeners = []
+        self._stop_checks = []
+        self._lock = threading.Lock()
+
+    def join(self, on_delta, should_stop):
+        """Add a caller, first replaying any text already streamed to it."""
+        with self._lock:
+            if on_delta is not None:
+                if self._parts:
+                    on_delta("".join(self._parts))
+                self._listeners.append(on_delta)
+            self._stop_checks.append(should_stop)
+
+    def publish(self, text):
+        # Listeners run under the lock so a late joiner's replay can't be
+        # overtaken by newer text.
+        with self._lock:
+            self._parts.append(text)
+            for on_delta in self._listeners:
+                on_delta(text)
+
+    def should_stop(self):
+        """True once every caller sharing the call has asked to stop."""
+        with self._lock:
+            checks = list(self._stop_checks)
+        return all(check is not None and check() for check in checks)
+
+class OpenAIClient:
+    """Own the HTTP session, timeouts and in-flight table for OpenAI calls."""
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, history=256):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_concurrency = max_concurrency
+        self.history = deque(maxlen=history)
+        self._session = None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.coalesced = 0
+
+    def install(self, openai_module):
+        """Make openai_module send every request through this client's session."""
+        with self._lock:
+            if self._session is None:
+                self._session = make_session(self.max_concurrency)
+            openai_module.requestssession = self._session
+
+    def close(self):
+        """Close the pooled connections, e.g. when the application exits."""
+        with self._lock:
+            if self._session is not None:
+                self._session.shutdown()
+
+    def timeout(self, read_timeout=None):
+        """Return the (connect, read) timeout for a request; read_timeout overrides the default."""
+        return (self.connect_timeout, read_timeout or self.read_timeout)
+
+    def call(self, key, send, on_delta=None, should_stop=None, coalesce=True):
+        """Run send(on_delta, should_stop) once per key in flight and return its result.
+
+        send performs the upstream request. It calls the on_delta it is given
+        with each streamed chunk, polls should_stop, and returns the result.
+        With coalesce=True a caller arriving while the same key is in flight
+        waits for that call and gets its result (or exception) instead. A
+        shared stream only stops early once every caller has asked to stop.
+        """
+        started = time.perf_counter()
+        leader = True
+        flight = None
+        if coalesce:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    leader = False
+                    self.coalesced += 1
+            flight.join(on_delta, should_stop)
+        if not leader:
+            metrics.inc("openai.coalesced")
+            flight.done.wait()
+            self._record(key, started, 0.0, True, flight.error)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+        queued = time.perf_counter() - started
+        metrics.observe("openai.queue_seconds", queued)
+        error = None
+        try:
+            if flight is None:
+                return send(on_delta or _ignore, should_stop or _never)
+            flight.result = send(flight.publish, flight.should_stop)
+            return flight.result
+        except Exception as e:
+            error = e
+            if flight is not None:
+                flight.error = e
+            raise
+        finally:
+            self._slots.release()
+            if flight is not None:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            self._record(key, started, queued, False, error)
+
+    def _record(self, key, started, queued, coalesced, error):
+        latency = time.perf_counter() - started
+        metrics.observe("openai.call_seconds", latency)
+        self.history.append({
+            "key": key,
+            "queued_seconds": queued,
+            "latency_seconds": latency,
+            "coalesced": coalesced,
+            "error": None if error is None else str(error),
+        })
+
+    def stats(self):
+        """Summarize recent calls: counts plus p50/p99 latency and queue time."""
+        records = list(self.history)
+
+        def percentile(values, q):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(q * len(values)))]
+        latencies = [r["latency_seconds"] for r in records]
+        queued = [r["queued_seconds"] for r in records if not r["coalesced"]]
+        with self._lock:
+            in_flight = len(self._flights)
+            waiting = self.waiting
+        return {
+            "recent_calls": len(records),
+            "errors": sum(1 for r in records if r["error"] is not None),
+            "coalesced_total": self.coalesced,
+            "in_flight": in_flight,
+            "waiting_for_slot": waiting,
+            "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+            "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+            "queued_p50_ms": percentile(queued, 0.5) * 1000,
+            "queued_p99_ms": percentile(queued, 0.99) * 1000,
+        }
@@ -1,40 +1,226 @@
 import os
 import json
 import re
-import openai
-from gi.repository import GLib
+import threading
+import time
 
-openai.api_key = os.environ["OPENAI_API_KEY"]
+import metrics
+from openai_client import OpenAIClient
+from response_cache import ResponseCache, make_key
 
-def generate_recipe(prompt, callback):
-    """Generate a recipe from the given prompt and call the callback with the formatted text and parsed data."""
-    messages = [
-        {"role": "system", "content": (
-            "You are a recipe generating assistant. When given a prompt, generate a recipe "
-            "as a JSON object with the following keys: 'name' (string), "
-            "'ingredients' (a comma-separated string), 'calories' (an integer), "
-            "and 'recipe_text' (string with full instructions). Ensure the JSON is valid."
-        )},
+# The openai package (and requests/aiohttp behind it) is slow to import, so
+# it is loaded on first use rather than when the GUI starts.
+_openai = None
+_openai_lock = threading.Lock()
+_settings = {}
+
+MODEL = "gpt-4"
+TEMPERATURE = 0.7
+MAX_TOKENS = 500
+SYSTEM_MESSAGE = (
+    "You are a recipe generating assistant. When given a prompt, generate a recipe "
+    "as a JSON object with the following keys: 'name' (string), "
+    "'ingredients' (a comma-separated string), 'calories' (an integer), "
+    "and 'recipe_text' (string with full instructions). Ensure the JSON is valid."
+)
+
+response_cache = ResponseCache()
+
+# Every request goes through this client: one pooled keep-alive session,
+# default timeouts, and coalescing of identical requests in flight.
+client = OpenAIClient()
+
+def _client():
+    """Import and configure the openai module on first use."""
+    global _openai
+    with _openai_lock:
+        if _openai is None:
+            import openai
+            openai.api_key = _settings.get("api_key") or os.environ["OPENAI_API_KEY"]
+            api_base = _settings.get("api_base") or os.environ.get("OPENAI_API_BASE")
+            if api_base:
+                # e.g. http://127.0.0.1:8808/v1 for fake_openai_server.py
+                openai.api_base = api_base
+            client.install(openai)
+            _openai = openai
+        return _openai
+
+def preload():
+    """Import the openai client now, e.g. from a background thread after startup."""
+    _client()
+
+def configure(api_base=None, api_key=None, connect_timeout=None, read_timeout=None):
+    """Point the client at another endpoint or key, e.g. a local fake server.
+
+    connect_timeout and read_timeout (seconds) replace the defaults used
+    when a request does not pass its own timeout.
+    """
+    if connect_timeout:
+        client.connect_timeout = connect_timeout
+    if read_timeout:
+        client.read_timeout = read_timeout
+    with _openai_lock:
+        if api_base:
+            _settings["api_base"] = api_base
+        if api_key:
+            _settings["api_key"] = api_key
+        if _openai is not None:
+            if api_base:
+                _openai.api_base = api_base
+            if api_key:
+                _openai.api_key = api_key
+
+def _cache_key(prompt):
+    return make_key(prompt, MODEL, TEMPERATURE, SYSTEM_MESSAGE)
+
+def cached_reply(prompt):
+    """Return the cached raw reply for prompt, or None."""
+    return response_cache.get(_cache_key(prompt))
+
+def remember_reply(prompt, raw_text, recipe_data):
+    """Cache the raw reply for prompt if it parsed as a recipe."""
+    _remember(_cache_key(prompt), raw_text, recipe_data)
+
+def _remember(key, raw_text, recipe_data):
+    """Cache a reply, but only once it parsed as a recipe."""
+    if recipe_data is not None:
+        response_cache.put(key, raw_text)
+
+def _messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
         {"role": "user", "content": prompt},
     ]
+
+def parse_recipe(raw_text):
+    """Parse the model's JSON reply and return the formatted text and parsed data."""
+    raw_text = raw_text.strip()
+    try:
+        recipe_data = json.loads(raw_text)
+        # Use our formatting utility.
+        from utils import format_recipe
+        formatted_text = format_recipe(recipe_data)
+    except (json.JSONDecodeError, AttributeError, TypeError, KeyError):
+        # Not JSON, or JSON that isn't a recipe object with string fields.
+        recipe_data = None
+        formatted_text = raw_text  # Fallback if JSON parsing fails
+    return formatted_text, recipe_data
+
+def _estimated_usage(prompt, completion):
+    """Approximate token usage at about four characters per token."""
+    return {"prompt_tokens": (len(SYSTEM_MESSAGE) + len(prompt)) // 4,
+            "completion_tokens": len(completion) // 4}
+
+def _create(prompt, timeout, stream=False):
+    return _client().ChatCompletion.create(
+        model=MODEL,
+        messages=_messages(prompt),
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+        request_timeout=client.timeout(timeout),
+        stream=stream,
+    )
+
+def complete(prompt, timeout=None, coalesce=True):
+    """Send one uncached completion request and return (raw_text, total_tokens).
+
+    Unlike request_recipe, API errors are raised so callers can retry them.
+    timeout (seconds) overrides the client's read timeout. With coalesce=True
+    a call made while the same prompt is already in flight shares its reply.
+    """
+    def send(on_delta, should_stop):
+        metrics.inc("openai.requests")
+        try:
+            with metrics.timer("openai.request_seconds"):
+                response = _create(prompt, timeout)
+        except Exception:
+            metrics.inc("openai.errors")
+            raise
+        metrics.record_usage(MODEL, response.usage)
+        return response.choices[0].message.content, response.usage.total_tokens
+    return client.call("complete:" + _cache_key(prompt), send, coalesce=coalesce)
+
+def request_recipe(prompt, timeout=None, use_cache=True):
+    """Generate a recipe from the given prompt and return the formatted text and parsed data.
+
+    This blocks for the whole API round trip, so call it from a worker thread.
+    timeout (seconds) bounds the HTTP request; errors are reported in the text.
+    With use_cache=False a cached reply is ignored and a fresh one requested.
+    """
+    key = _cache_key(prompt)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return parse_recipe(cached)
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500,
-        )
-        raw_text = response.choices[0].message.content.strip()
+        # A fresh reply was asked for, so don't share someone else's.
+        raw_text, _ = complete(prompt, timeout=timeout, coalesce=use_cache)
+    except Exception as e:
+        return f"Error generating recipe: {e}", None
+    formatted_text, recipe_data = parse_recipe(raw_text)
+    _remember(key, raw_text, recipe_data)
+    return formatted_text, recipe_data
+
+def stream_recipe(prompt, on_delta, timeout=None, should_stop=None, use_cache=True):
+    """Like request_recipe, but stream the reply as it is generated.
+
+    on_delta(text) is called from the calling thread with each chunk of raw
+    model output. should_stop, if given, is polled between chunks and ends
+    the stream early when it returns True. The assembled reply is parsed
+    once the stream finishes. A cached reply is delivered as a single chunk.
+    """
+    key = _cache_key(prompt)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            on_delta(cached)
+            return parse_recipe(cached)
+
+    def send(publish, stopped):
+        parts = []
+        usage = None
+        metrics.inc("openai.streams")
+        started = time.perf_counter()
         try:
-            recipe_data = json.loads(raw_text)
-            # Use our formatting utility.
-            from utils import format_recipe
-            formatted_text = format_recipe(recipe_data)
-        except json.JSONDecodeError:
-            recipe_data = None
-            formatted_text = raw_text  # Fallback if JSON parsing fails
+            for chunk in _create(prompt, timeout, stream=True):
+                if stopped():
+                    break
+                # Servers that report usage on a stream do it in the last chunk,
+                # whose choices may be empty.
+                usage = chunk.get("usage") or usage
+                if not chunk["choices"]:
+                    continue
+                delta = chunk["choices"][0]["delta"].get("content")
+                if delta:
+                    if not parts:
+                        metrics.observe("openai.first_token_seconds", time.perf_counter() - started)
+                    parts.append(delta)
+                    publish(delta)
+        except Exception:
+            metrics.inc("openai.errors")
+            raise
+        finally:
+            # Tokens streamed before a stop or an error are billed too.
+            if usage is not None or parts:
+                metrics.record_usage(MODEL, usage or _estimated_usage(prompt, "".join(parts)))
+        metrics.observe("openai.stream_seconds", time.perf_counter() - started)
+        return "".join(parts), stopped()
+
+    try:
+        # Callers streaming the same prompt share one stream, which only
+        # ends early once all of them have asked to stop.
+        raw_text, stopped_early = client.call("stream:" + key, send, on_delta, should_stop,
+                                              coalesce=use_cache)
     except Exception as e:
-        formatted_text = f"Error generating recipe: {e}"
-        recipe_data = None
+        return f"Error generating recipe: {e}", None
+    formatted_text, recipe_data = parse_recipe(raw_text)
+    if not stopped_early:
+        _remember(key, raw_text, recipe_data)
+    return formatted_text, recipe_data
+
+def generate_recipe(prompt, callback):
+    """Generate a recipe from the given prompt and call the callback with the formatted text and parsed data."""
+    from gi.repository import GLib
+    formatted_text, recipe_data = request_recipe(prompt)
     # Pass the result to the callback on the main thread.
     GLib.idle_add(callback, formatted_text, recipe_data)
@@ -0,0 +1,129 @@
+import difflib
+from collections import OrderedDict
+
+import metrics
+from db import load_recipe_page
+
+class RecipeListModel:
+    """Feed the Recipe Book's Gtk.ListStore from SQLite one page at a time.
+
+    Only the pages the user has scrolled to are in the store. Fetched pages
+    are kept in a bounded LRU cache, and when the query or the data changes
+    the store is patched with the difference between the old and new rows
+    instead of being cleared and refilled, so checkbox state survives.
+
+    Store rows are [checked, id, name, calories], as built by RecipeApp.
+    Further pages are fetched off the main loop: next_page() says which one
+    to fetch, fetch() runs on a worker thread, and add_page() appends it.
+    """
+
+    def __init__(self, liststore, page_size=200, max_cached_pages=64, fetch_page=load_recipe_page):
+        self.liststore = liststore
+        self.page_size = page_size
+        self.max_cached_pages = max_cached_pages
+        self.fetch_page = fetch_page
+        self.filters = {}
+        self.exhausted = False
+        self._pages = OrderedDict()
+        self._loading = None  # (filters, index) of the page being fetched.
+
+    def set_rows(self, filters, rows):
+        """Show the first page of a search whose rows were fetched elsewhere.
+
+        filters are the fetch_page arguments (search_text, min_cal, max_cal,
+        order_by) the rows were fetched with.
+        """
+        self.filters = filters
+        self._loading = None
+        self._remember(0, rows)
+        self.exhausted = len(rows) < self.page_size
+        self._apply(rows)
+
+    def next_page(self):
+        """Return the (filters, index) of the page to fetch next, e.g. when the
+        list is scrolled near its end, or None if there is nothing to fetch.
+
+        A cached page is appended straight away instead.
+        """
+        if self.exhausted or self._loading is not None:
+            return None
+        index = len(self.liststore) // self.page_size
+        page = self._pages.get(self._key(index))
+        if page is not None:
+            self._pages.move_to_end(self._key(index))
+            self._append(page)
+            return None
+        self._loading = (self.filters, index)
+        return self._loading
+
+    def fetch(self, filters, index):
+        """Read one page; safe to call from a worker thread."""
+        return self.fetch_page(**filters, limit=self.page_size, offset=index * self.page_size)
+
+    def add_page(self, filters, index, page):
+        """Append a page requested by next_page(), unless the list has moved on since."""
+        if self._loading != (filters, index):
+            return
+        self._loading = None
+        self._remember(index, page)
+        self._append(page)
+
+    def _append(self, page):
+        self.exhausted = len(page) < self.page_size
+        with metrics.timer("gui.list_append_seconds"):
+            for recipe_id, name, calories in page:
+                self.liststore.append([False, recipe_id, name, calories])
+
+    def invalidate(self):
+        """Drop cached pages and re-read every page currently shown."""
+        self._pages.clear()
+        self._loading = None
+        pages = max(1, -(-len(self.liststore) // self.page_size))
+        self._load(pages)
+
+    def _load(self, pages):
+        rows = []
+        self.exhausted = False
+        for index in range(pages):
+            page = self._page(index)
+            rows.extend(page)
+            if len(page) < self.page_size:
+                self.exhausted = True
+                break
+        self._apply(rows)
+
+    def _page(self, index):
+        key = self._key(index)
+        page = self._pages.get(key)
+        if page is None:
+            page = self.fetch_page(**self.filters, limit=self.page_size, offset=index * self.page_size)
+            self._remember(index, page)
+        else:
+            self._pages.move_to_end(key)
+        return page
+
+    def _key(self, index):
+        return (tuple(sorted(self.filters.items())), index)
+
+    def _remember(self, index, page):
+        self._pages[self._key(index)] = page
+        while len(self._pages) > self.max_cached_pages:
+            self._pages.popitem(last=False)
+
+    @metrics.timed("gui.list_update_seconds")
+    def _apply(self, rows):
+        """Patch the store so its rows match rows, touching only what changed."""
+        store = self.liststore
+        old_ids = [row[1] for row in store]
+        new_ids = [row[0] for row in rows]
+        matcher = difflib.SequenceMatcher(None, old_ids, new_ids, autojunk=False)
+        # Apply from the end so earlier positions stay valid.
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if i2 > i1:
+                treeiter = store.iter_nth_child(None, i1)
+                for _ in range(i2 - i1):
+                    store.remove(treeiter)
+            for offset, (recipe_id, name, calories) in enumerate(rows[j1:j2]):
+                store.insert(i1 + offset, [False, recipe_id, name, calories])
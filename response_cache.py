@@ -0,0 +1,89 @@
+import hashlib
+import json
+import threading
+import time
+
+import metrics
+from db import get_connections
+
+def normalize_prompt(prompt):
+    """Lower-case the prompt and collapse whitespace so trivial edits share a key."""
+    return " ".join(prompt.lower().split())
+
+def make_key(prompt, model, temperature, system_message):
+    """Return the cache key for a generation request."""
+    payload = json.dumps([normalize_prompt(prompt), model, temperature, system_message])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Persistent cache of raw model replies in the response_cache table.
+
+    Entries expire ttl seconds after they were stored. Once the table holds
+    more than max_entries rows the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached reply for key, or None on a miss."""
+        now = time.time()
+        with get_connections().read() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self._count(hit=False)
+            if row is not None:
+                with get_connections().write() as conn:
+                    conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        with get_connections().write() as conn:
+            conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+        self._count(hit=True)
+        return row[0]
+
+    def put(self, key, response):
+        """Store a reply, evicting the least recently used entries over the cap."""
+        now = time.time()
+        with get_connections().write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, created_at, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self):
+        """Remove every cached reply."""
+        with get_connections().write() as conn:
+            conn.execute("DELETE FROM response_cache")
+
+    def stats(self):
+        """Return hit/miss counters for this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _count(self, hit):
+        metrics.inc("response_cache.hits" if hit else "response_cache.misses")
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from gi.repository import GLib
+
+import metrics
+
+class SearchController:
+    """Debounce search input and run the query off the GTK main loop.
+
+    request() may be called on every keystroke. The query only starts once
+    input has been quiet for delay_ms, runs on a background thread (which
+    reads through its own pooled reader connection), and its rows are handed
+    to on_results(args, rows) on the main loop. Every request bumps a
+    generation counter; any search that is superseded before it starts or
+    finishes is dropped, so only the latest results are ever published.
+    fetch_more() runs other reads for the current results, such as their
+    next page, on the same thread.
+    """
+
+    def __init__(self, fetch, on_results, delay_ms=150, history=256):
+        self.fetch = fetch
+        self.on_results = on_results
+        self.delay_ms = delay_ms
+        self._generation = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.latencies = deque(maxlen=history)
+        self.dropped = 0
+
+    def request(self, *args, delay_ms=None):
+        """Schedule a search for args, superseding any earlier request.
+
+        delay_ms overrides the debounce delay, e.g. 0 for an initial load.
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+        delay = self.delay_ms if delay_ms is None else delay_ms
+        self._timer = GLib.timeout_add(delay, self._start, generation, args)
+
+    def fetch_more(self, fetch, on_results, *args):
+        """Run fetch(*args) on the search thread and pass on_results(args, rows) on the main loop.
+
+        Like a search, the result is dropped if a new search is requested first.
+        """
+        with self._lock:
+            generation = self._generation
+        self._executor.submit(self._run, generation, fetch, on_results, args)
+
+    def cancel(self):
+        """Drop any pending or running search."""
+        with self._lock:
+            self._generation += 1
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _is_current(self, generation):
+        with self._lock:
+            return generation == self._generation
+
+    def _start(self, generation, args):
+        self._timer = None
+        self._executor.submit(self._run, generation, self.fetch, self.on_results, args)
+        return False
+
+    def _run(self, generation, fetch, on_results, args):
+        if not self._is_current(generation):
+            self.dropped += 1
+            metrics.inc("search.dropped")
+            return
+        started = time.perf_counter()
+        rows = fetch(*args)
+        latency = time.perf_counter() - started
+        self.latencies.append(latency)
+        metrics.observe("search.query_seconds", latency)
+        GLib.idle_add(self._publish, generation, on_results, args, rows)
+
+    def _publish(self, generation, on_results, args, rows):
+        if self._is_current(generation):
+            on_results(args, rows)
+        else:
+            self.dropped += 1
+            metrics.inc("search.dropped")
+        return False
+
+    def stats(self):
+        """Return query latency figures (in seconds) for recent searches."""
+        samples = sorted(self.latencies)
+        if not samples:
+            return {"count": 0, "dropped": self.dropped}
+        return {
+            "count": len(samples),
+            "dropped": self.dropped,
+            "last": self.latencies[-1],
+            "p50": samples[len(samples) // 2],
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max": samples[-1],
+        }
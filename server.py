@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""Serve the recipe book over a headless HTTP/JSON API.
+
+Built on asyncio streams with no extra dependencies. Connections are kept
+alive between requests. Database reads run on a small thread pool sized to
+db's reader connections, writes go through a single writer thread, and
+generation requests are limited by a semaphore with a bounded wait queue.
+
+    GET    /health
+    GET    /recipes?q=&min_cal=&max_cal=&order=&limit=&offset=
+    GET    /recipes?...&stream=1      every match, streamed as a chunked JSON array
+    GET    /recipes/<id>
+    POST   /recipes                   a recipe object, or a list of them
+    DELETE /recipes/<id>
+    DELETE /recipes                   {"ids": [...]}
+    POST   /generate                  {"prompt": ..., "use_cache": true, "save": false, "stream": false}
+    GET    /stats
+
+With "stream": true, /generate sends newline-delimited JSON: {"delta": ...}
+objects as the reply arrives, then the final result.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, urlsplit
+
+import db
+import metrics
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 8 * 1024 * 1024
+MAX_PAGE = 5000
+STREAM_BATCH = 500
+
+REASONS = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+    431: "Request Header Fields Too Large", 500: "Internal Server Error",
+    501: "Not Implemented", 503: "Service Unavailable",
+}
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+class _StreamAborted(Exception):
+    """A streamed response failed after its headers were sent."""
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        parts = urlsplit(target)
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError as e:
+            raise HTTPError(400, f"invalid JSON body: {e}")
+
+def _int_param(query, name, default=None):
+    value = query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+
+def _recipe_fields(data):
+    """Validate one recipe object from a request body and return save_recipe arguments."""
+    if not isinstance(data, dict):
+        raise HTTPError(400, "a recipe must be a JSON object")
+    try:
+        calories = int(data.get("calories") or 0)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "calories must be an integer")
+    return (str(data.get("name") or "Unnamed Recipe"), str(data.get("ingredients") or ""),
+            str(data.get("recipe_text") or ""), calories)
+
+class RecipeServer:
+    """The HTTP API; call start() inside a running event loop."""
+
+    def __init__(self, host="127.0.0.1", port=8080, read_workers=4, generation_concurrency=4,
+                 max_queued_generations=32, idle_timeout=15.0):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.max_queued_generations = max_queued_generations
+        self._read_executor = ThreadPoolExecutor(read_workers, thread_name_prefix="server-read")
+        self._write_executor = ThreadPoolExecutor(1, thread_name_prefix="server-write")
+        self._generation_executor = ThreadPoolExecutor(generation_concurrency,
+                                                       thread_name_prefix="server-generate")
+        self._generation_slots = asyncio.Semaphore(generation_concurrency)
+        self._queued_generations = 0
+        self._server = None
+        self.stats = {"connections": 0, "open_connections": 0, "requests": 0, "errors": 0,
+                      "generations": 0, "generations_rejected": 0}
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for executor in (self._read_executor, self._write_executor, self._generation_executor):
+            executor.shutdown(wait=False)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    # -- connection handling ----------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        self.stats["connections"] += 1
+        self.stats["open_connections"] += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, False, e.headers)
+                    return
+                if request is None:
+                    return
+                keep_alive = await self._respond(request, writer)
+                if not keep_alive:
+                    return
+        finally:
+            self.stats["open_connections"] -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None  # Client closed an idle keep-alive connection.
+            raise
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "request headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(501, "chunked request bodies are not supported")
+        body = b""
+        length = headers.get("content-length")
+        if length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                raise HTTPError(400, "invalid Content-Length")
+            if length > MAX_BODY_BYTES:
+                raise HTTPError(413, "request body too large")
+            body = await reader.readexactly(length)
+        elif method in ("POST", "PUT"):
+            raise HTTPError(411, "Content-Length required")
+        return Request(method, target, version, headers, body)
+
+    async def _respond(self, request, writer):
+        """Handle one request and return whether the connection stays open."""
+        self.stats["requests"] += 1
+        metrics.inc("server.requests")
+        keep_alive = request.keep_alive
+        started = time.perf_counter()
+        try:
+            # Handlers return (status, payload) or, to stream, (status, content type, chunks).
+            result = await self._dispatch(request)
+            if len(result) == 2:
+                await self._send_json(writer, *result, keep_alive)
+            else:
+                await self._send_chunked(writer, result, keep_alive)
+        except HTTPError as e:
+            self.stats["errors"] += 1
+            await self._send_json(writer, e.status, {"error": e.message}, keep_alive, e.headers)
+        except ConnectionError:
+            return False
+        except _StreamAborted as e:
+            self.stats["errors"] += 1
+            metrics.inc("server.errors")
+            print(f"error streaming {request.method} {request.path}: {e.__cause__!r}", file=sys.stderr)
+            return False
+        except Exception as e:
+            self.stats["errors"] += 1
+            metrics.inc("server.errors")
+            print(f"error handling {request.method} {request.path}: {e!r}", file=sys.stderr)
+            await self._send_json(writer, 500, {"error": "internal server error"}, False)
+            return False
+        finally:
+            metrics.observe("server.request_seconds", time.perf_counter() - started)
+        return keep_alive
+
+    def _head(self, status, headers, keep_alive):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}"]
+        headers = dict(headers)
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_json(self, writer, status, payload, keep_alive, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        head = self._head(status, {"Content-Type": "application/json",
+                                   "Content-Length": len(body), **(headers or {})}, keep_alive)
+        writer.write(head + body)
+        await writer.drain()
+
+    async def _send_chunked(self, writer, stream, keep_alive):
+        """Send a streamed response; stream is a (status, content type, async iterator of bytes)."""
+        status, content_type, chunks = stream
+        writer.write(self._head(status, {"Content-Type": content_type,
+                                         "Transfer-Encoding": "chunked"}, keep_alive))
+        try:
+            try:
+                async for chunk in chunks:
+                    if chunk:
+                        writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        await writer.drain()
+            finally:
+                await chunks.aclose()
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # The 200 head is already out, so no error response can follow.
+            # Drop the connection without the terminating chunk so the client
+            # sees a truncated response rather than a complete one.
+            writer.transport.abort()
+            raise _StreamAborted from e
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # -- routing ----------------------------------------------------------
+
+    async def _dispatch(self, request):
+        method, path = request.method, request.path
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/stats":
+            import openai_integration
+            return 200, {"server": dict(self.stats), "openai": openai_integration.client.stats(),
+                         "metrics": metrics.registry.snapshot()}
+        if path == "/recipes":
+            if method == "GET":
+                return await self._search(request)
+            if method == "POST":
+                return await self._save(request)
+            if method == "DELETE":
+                return await self._delete_many(request)
+            raise HTTPError(405, "use GET, POST or DELETE")
+        if path.startswith("/recipes/"):
+            try:
+                recipe_id = int(path[len("/recipes/"):])
+            except ValueError:
+                raise HTTPError(404, "not found")
+            if method == "GET":
+                return await self._fetch(recipe_id)
+            if method == "DELETE":
+                if not await self._write(db.delete_recipe, recipe_id):
+                    raise HTTPError(404, f"no recipe with id {recipe_id}")
+                return 200, {"deleted": 1}
+            raise HTTPError(405, "use GET or DELETE")
+        if path == "/generate":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            return await self._generate(request)
+        raise HTTPError(404, "not found")
+
+    async def _read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, lambda: func(*args, **kwargs))
+
+    async def _write(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor, lambda: func(*args, **kwargs))
+
+    def _filters(self, query):
+        order_by = query.get("order") or None
+        if order_by is not None and order_by not in db.SORT_ORDERS:
+            raise HTTPError(400, f"order must be one of {', '.join(db.SORT_ORDERS)}")
+        return {
+            "search_text": query.get("q", ""),
+            "min_cal": _int_param(query, "min_cal"),
+            "max_cal": _int_param(query, "max_cal"),
+            "order_by": order_by,
+        }
+
+    async def _search(self, request):
+        filters = self._filters(request.query)
+        if request.query.get("stream") in ("1", "true"):
+            limit = _int_param(request.query, "limit")
+            if limit is not None:
+                # SQLite treats a negative LIMIT as no limit at all.
+                limit = max(limit, 1)
+            return 200, "application/json", self._stream_rows(filters, limit)
+        limit = min(max(_int_param(request.query, "limit", 200), 1), MAX_PAGE)
+        offset = _int_param(request.query, "offset", 0)
+        if offset < 0:
+            raise HTTPError(400, "offset must not be negative")
+        rows = await self._read(db.load_recipe_page, **filters, limit=limit, offset=offset)
+        return 200, {"recipes": [{"id": i, "name": name, "calories": calories}
+                                 for i, name, calories in rows]}
+
+    async def _stream_rows(self, filters, limit):
+        """Yield a JSON array of every matching row, a batch at a time.
+
+        A read-pool thread pages through one cursor and hands batches over a
+        small queue, so a slow client holds back the query instead of the
+        server buffering the whole result.
+        """
+        loop = asyncio.get_running_loop()
+        batches = asyncio.Queue(maxsize=4)
+        stop = threading.Event()
+        done = object()
+        rows = None
+
+        def produce():
+            try:
+                for rows in db.iter_recipe_rows(**filters, limit=limit, batch_size=STREAM_BATCH):
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(batches.put(rows), loop).result()
+            except Exception as e:
+                asyncio.run_coroutine_threadsafe(batches.put(e), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(batches.put(done), loop).result()
+
+        loop.run_in_executor(self._read_executor, produce)
+        first = True
+        try:
+            yield b"["
+            while True:
+                rows = await batches.get()
+                if rows is done:
+                    break
+                if isinstance(rows, Exception):
+                    raise rows
+                parts = [json.dumps({"id": i, "name": name, "calories": calories})
+                         for i, name, calories in rows]
+                yield (b"" if first else b",") + ",".join(parts).encode("utf-8")
+                first = False
+            yield b"]"
+        finally:
+            # Unblock the producer if the client went away mid-stream.
+            stop.set()
+            while rows is not done:
+                rows = await batches.get()
+
+    async def _fetch(self, recipe_id):
+        row = await self._read(db.get_recipe, recipe_id)
+        if row is None:
+            raise HTTPError(404, f"no recipe with id {recipe_id}")
+        recipe_id, name, ingredients, recipe_text, calories = row
+        return 200, {"id": recipe_id, "name": name, "ingredients": ingredients,
+                     "recipe_text": recipe_text, "calories": calories}
+
+    async def _save(self, request):
+        data = request.json()
+        if isinstance(data, list):
+            recipes = [_recipe_fields(item) for item in data]
+            return 201, {"saved": await self._write(db.save_recipes, recipes)}
+        recipe_id = await self._write(db.save_recipe, *_recipe_fields(data))
+        return 201, {"id": recipe_id}
+
+    async def _delete_many(self, request):
+        data = request.json()
+        ids = data.get("ids") if isinstance(data, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            raise HTTPError(400, 'expected {"ids": [integers]}')
+        return 200, {"deleted": await self._write(db.delete_recipes, ids)}
+
+    async def _generate(self, request):
+        data = request.json()
+        if not isinstance(data, dict) or not str(data.get("prompt") or "").strip():
+            raise HTTPError(400, 'expected {"prompt": "..."}')
+        if self._queued_generations >= self.max_queued_generations:
+            self.stats["generations_rejected"] += 1
+            metrics.inc("server.generations_rejected")
+            raise HTTPError(503, "too many generation requests", {"Retry-After": 1})
+        prompt = data["prompt"].strip()
+        use_cache = bool(data.get("use_cache", True))
+        save = bool(data.get("save", False))
+        if data.get("stream"):
+            return 200, "application/x-ndjson", self._stream_generation(prompt, use_cache, save)
+        async with self._generation_slot():
+            return 200, await self._run_generation(prompt, use_cache, save)
+
+    @asynccontextmanager
+    async def _generation_slot(self):
+        """Wait (counted against max_queued_generations) for a free generation slot."""
+        self._queued_generations += 1
+        try:
+            await self._generation_slots.acquire()
+        finally:
+            self._queued_generations -= 1
+        self.stats["generations"] += 1
+        try:
+            yield
+        finally:
+            self._generation_slots.release()
+
+    def _finish_generation(self, text, recipe_data, save):
+        """Runs on a generation thread: optionally save, and build the response."""
+        result = {"text": text, "recipe": recipe_data}
+        if save and recipe_data:
+            result["id"] = db.save_recipe(recipe_data.get("name", "Unnamed Recipe"),
+                                          recipe_data.get("ingredients", ""), text,
+                                          int(recipe_data.get("calories") or 0))
+        return result
+
+    async def _run_generation(self, prompt, use_cache, save):
+        import openai_integration
+
+        def run():
+            text, recipe_data = openai_integration.request_recipe(prompt, use_cache=use_cache)
+            return self._finish_generation(text, recipe_data, save)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._generation_executor, run)
+
+    async def _stream_generation(self, prompt, use_cache, save):
+        import openai_integration
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        stop = threading.Event()
+
+        def on_delta(text):
+            loop.call_soon_threadsafe(events.put_nowait, {"delta": text})
+
+        def run():
+            try:
+                text, recipe_data = openai_integration.stream_recipe(
+                    prompt, on_delta, should_stop=stop.is_set, use_cache=use_cache)
+                result = self._finish_generation(text, recipe_data, save)
+            except Exception as e:
+                result = {"error": str(e)}
+            loop.call_soon_threadsafe(events.put_nowait, {"done": result})
+
+        async with self._generation_slot():
+            future = loop.run_in_executor(self._generation_executor, run)
+            try:
+                while True:
+                    event = await events.get()
+                    if "done" in event:
+                        yield (json.dumps(event["done"]) + "\n").encode("utf-8")
+                        break
+                    yield (json.dumps(event) + "\n").encode("utf-8")
+            finally:
+                stop.set()
+                await future
+
+async def serve(args):
+    db.DB_FILE = args.db
+    db.init_db()
+    if args.api_base:
+        import openai_integration
+        openai_integration.configure(api_base=args.api_base)
+    server = RecipeServer(args.host, args.port, args.read_workers, args.generation_concurrency,
+                          args.max_queued_generations, args.idle_timeout)
+    await server.start()
+    print(f"recipe book API listening on {server.url}", file=sys.stderr)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+        import openai_integration
+        openai_integration.client.close()
+        db.close_db()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", default=db.DB_FILE,
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    parser.add_argument("--read-workers", type=int, default=4,
+                        help="threads running database reads (match the reader pool)")
+    parser.add_argument("--generation-concurrency", type=int, default=4,
+                        help="generation requests sent to the API at once")
+    parser.add_argument("--max-queued-generations", type=int, default=32,
+                        help="generation requests allowed to wait before answering 503")
+    parser.add_argument("--idle-timeout", type=float, default=15.0,
+                        help="seconds an idle keep-alive connection is held open")
+    parser.add_argument("--api-base", help="OpenAI-compatible base URL (e.g. the fake server)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""Find recipes similar to a given one with a hashed TF-IDF matrix.
+
+Every recipe becomes a sparse row of hashed features: its normalized
+ingredients and the words of its name. Scoring all recipes against one is
+a single sparse matrix-vector product weighted by IDF, followed by a top-k
+partition. The matrix is kept next to the database in .npy files that are
+memory-mapped on load. Saves and deletes are queued to a background
+thread, which applies them to a small delta that is folded into the main
+matrix once it grows, so the thread that saved never waits on the index.
+The index is rebuilt from scratch only when asked to (rebuild(), or
+--rebuild).
+"""
+import argparse
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+import db
+import metrics
+from utils import normalize_ingredient, split_ingredients
+
+N_FEATURES = 1 << 18
+
+# Fold the delta into the main matrix once it holds this many rows, or this
+# fraction of the main matrix, whichever is larger.
+COMPACT_ROWS = 2000
+COMPACT_FRACTION = 0.1
+
+_WORD = re.compile(r"[a-z]+")
+
+def features(name, ingredients):
+    """Return the set of hashed feature columns for a recipe."""
+    items = {"i:" + item for item in map(normalize_ingredient, split_ingredients(ingredients)) if item}
+    items.update("n:" + word for word in _WORD.findall((name or "").lower()) if len(word) > 2)
+    return {zlib.crc32(item.encode("utf-8")) % N_FEATURES for item in items}
+
+def _rows_to_csr(rows):
+    """Build a CSR matrix from a list of feature-column sets."""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((col for row in rows for col in sorted(row)),
+                          dtype=np.int32, count=int(indptr[-1]))
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), N_FEATURES))
+
+class SimilarityIndex:
+    """Hashed TF-IDF rows for every recipe, persisted under directory.
+
+    The main matrix is stored as base-<generation>-*.npy files named by
+    manifest.json and opened memory-mapped. Rows added since then live in
+    memory and in delta-<generation>.npz, along with the IDs deleted from
+    the main matrix.
+
+    Changes reported through on_change() are applied by a worker thread;
+    wait() blocks until it has caught up. Any still queued when the process
+    exits are picked up by sync() the next time the index is opened.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._base = sparse.csr_matrix((0, N_FEATURES), dtype=np.float32)
+        self._base_ids = np.zeros(0, dtype=np.int64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._delta = {}  # recipe_id -> feature set
+        self._df = np.zeros(N_FEATURES, dtype=np.int64)
+        self._delta_matrix = None  # CSR form of _delta, rebuilt lazily.
+        self._norms = None  # Row norms under the current IDF, recomputed lazily.
+        self._changes = queue.Queue()
+        self._worker = None
+
+    # -- persistence ------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _manifest(self):
+        try:
+            with open(self._path("manifest.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self):
+        """Open the persisted matrix; return False if there is none yet."""
+        manifest = self._manifest()
+        if manifest is None or manifest.get("n_features") != N_FEATURES:
+            return False
+        generation = manifest["generation"]
+        prefix = self._path(f"base-{generation}-")
+        try:
+            data = np.load(prefix + "data.npy", mmap_mode="r")
+            indices = np.load(prefix + "indices.npy", mmap_mode="r")
+            indptr = np.load(prefix + "indptr.npy", mmap_mode="r")
+            ids = np.load(prefix + "ids.npy")
+        except OSError:
+            return False
+        with self._lock:
+            self._generation = generation
+            self._base = sparse.csr_matrix((data, indices, indptr),
+                                           shape=(len(ids), N_FEATURES), copy=False)
+            self._base_ids = ids
+            self._alive = np.ones(len(ids), dtype=bool)
+            self._delta = {}
+            delta_path = self._path(f"delta-{generation}.npz")
+            if os.path.exists(delta_path):
+                with np.load(delta_path) as delta:
+                    rows = np.split(delta["indices"], delta["indptr"][1:-1])
+                    self._delta = {int(i): set(row.tolist()) for i, row in zip(delta["ids"], rows)}
+                    self._alive &= ~np.isin(ids, delta["deleted"])
+            self._recount()
+        return True
+
+    def _save_delta(self):
+        rows = list(self._delta.values())
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.fromiter((col for row in rows for col in row), dtype=np.int32,
+                              count=int(indptr[-1]))
+        tmp = self._path(f"delta-{self._generation}.tmp.npz")
+        np.savez(tmp, ids=np.array(list(self._delta), dtype=np.int64), indices=indices,
+                 indptr=indptr, deleted=self._base_ids[~self._alive])
+        os.replace(tmp, self._path(f"delta-{self._generation}.npz"))
+
+    def _write_base(self, matrix, ids):
+        """Write matrix as a new generation and switch the manifest to it."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Never overwrite files another index may still have memory-mapped.
+        manifest = self._manifest() or {}
+        generation = max(self._generation, manifest.get("generation", 0)) + 1
+        prefix = self._path(f"base-{generation}-")
+        for name, array in (("data", matrix.data), ("indices", matrix.indices),
+                            ("indptr", matrix.indptr), ("ids", ids)):
+            np.save(prefix + name + ".npy", array)
+        tmp = self._path("manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "n_features": N_FEATURES, "rows": len(ids)}, f)
+        os.replace(tmp, self._path("manifest.json"))
+        for name in os.listdir(self.directory):
+            if (name.startswith(("base-", "delta-"))
+                    and not name.startswith(f"base-{generation}-")):
+                os.remove(self._path(name))
+        self._generation = generation
+
+    # -- building and updating ---------------------------------------------
+
+    def rebuild(self, batch_size=5000):
+        """Build the whole matrix from the recipes table and persist it."""
+        ids = []
+        rows = []
+        last_id = 0
+        while True:
+            with db.get_connections().read() as conn:
+                batch = conn.execute(
+                    "SELECT id, name, ingredients FROM recipes WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            for recipe_id, name, ingredients in batch:
+                ids.append(recipe_id)
+                rows.append(features(name, ingredients))
+        with self._lock:
+            self._write_base(_rows_to_csr(rows), np.array(ids, dtype=np.int64))
+        return self.load()
+
+    def compact(self):
+        """Fold the delta into a new memory-mapped main matrix."""
+        with self._lock:
+            keep = self._base[self._alive]
+            delta_ids = list(self._delta)
+            matrix = sparse.vstack([keep, _rows_to_csr(list(self._delta.values()))], format="csr")
+            ids = np.concatenate([self._base_ids[self._alive],
+                                  np.array(delta_ids, dtype=np.int64)])
+            order = np.argsort(ids, kind="stable")
+            self._write_base(matrix[order], ids[order])
+            self.load()
+
+    def sync(self):
+        """Apply any saves or deletes made to the database behind the index's back."""
+        with db.get_connections().read() as conn:
+            current = np.fromiter((row[0] for row in conn.execute("SELECT id FROM recipes")),
+                                  dtype=np.int64)
+        with self._lock:
+            indexed = np.concatenate([self._base_ids[self._alive],
+                                      np.array(list(self._delta), dtype=np.int64)])
+            removed = np.setdiff1d(indexed, current)
+            added = np.setdiff1d(current, indexed)
+        if len(removed):
+            self.remove(removed.tolist())
+        if len(added):
+            self.add(added.tolist())
+
+    def add(self, recipe_ids):
+        """Index recipes that were just saved."""
+        rows = self._load_rows(recipe_ids)
+        with self._lock:
+            self._add_rows(rows)
+            self._changed()
+
+    def _load_rows(self, recipe_ids):
+        rows = {}
+        with db.get_connections().read() as conn:
+            for start in range(0, len(recipe_ids), db._MAX_SQL_VARIABLES):
+                chunk = recipe_ids[start:start + db._MAX_SQL_VARIABLES]
+                placeholders = ", ".join("?" * len(chunk))
+                for recipe_id, name, ingredients in conn.execute(
+                        f"SELECT id, name, ingredients FROM recipes WHERE id IN ({placeholders})",
+                        chunk):
+                    rows[recipe_id] = features(name, ingredients)
+        return rows
+
+    def _add_rows(self, rows):
+        for recipe_id, row in rows.items():
+            if self._position(recipe_id) is not None or recipe_id in self._delta:
+                continue
+            self._delta[recipe_id] = row
+            self._df[list(row)] += 1
+
+    def remove(self, recipe_ids):
+        """Drop deleted recipes from the index."""
+        with self._lock:
+            self._remove_rows(recipe_ids)
+            self._changed()
+
+    def _remove_rows(self, recipe_ids):
+        for recipe_id in recipe_ids:
+            row = self._delta.pop(recipe_id, None)
+            if row is None:
+                position = self._position(recipe_id)
+                if position is None or not self._alive[position]:
+                    continue
+                self._alive[position] = False
+                row = self._base.indices[self._base.indptr[position]:self._base.indptr[position + 1]]
+            self._df[list(row)] -= 1
+
+    def _changed(self):
+        self._delta_matrix = None
+        self._norms = None
+        threshold = max(COMPACT_ROWS, int(len(self._base_ids) * COMPACT_FRACTION))
+        if len(self._delta) + int((~self._alive).sum()) > threshold:
+            self.compact()
+        elif os.path.isdir(self.directory):
+            self._save_delta()
+
+    def on_change(self, event, recipe_ids):
+        """db change listener queueing saves and deletes for the worker thread."""
+        if event not in ("save", "delete"):
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="similar-index", daemon=True)
+                self._worker.start()
+        self._changes.put((event, list(recipe_ids)))
+
+    def wait(self):
+        """Block until every change queued so far has been applied."""
+        self._changes.join()
+
+    def _run(self):
+        while True:
+            changes = [self._changes.get()]
+            # Apply everything queued meanwhile with one delta write (or compaction).
+            while True:
+                try:
+                    changes.append(self._changes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(changes)
+            except Exception:
+                # Keep the worker alive; sync() repairs the index when it is next opened.
+                metrics.inc("similar.update_failures")
+            finally:
+                for _ in changes:
+                    self._changes.task_done()
+
+    def _apply(self, changes):
+        for event, recipe_ids in changes:
+            if event == "save":
+                rows = self._load_rows(recipe_ids)
+                with self._lock:
+                    self._add_rows(rows)
+            else:
+                with self._lock:
+                    self._remove_rows(recipe_ids)
+        with self._lock:
+            self._changed()
+
+    def _position(self, recipe_id):
+        position = int(np.searchsorted(self._base_ids, recipe_id))
+        if position < len(self._base_ids) and self._base_ids[position] == recipe_id:
+            return position
+        return None
+
+    def _recount(self):
+        """Recompute document frequencies from the live rows."""
+        self._df = np.bincount(self._base[self._alive].indices, minlength=N_FEATURES).astype(np.int64)
+        for row in self._delta.values():
+            self._df[list(row)] += 1
+        self._delta_matrix = None
+        self._norms = None
+
+    # -- querying ---------------------------------------------------------
+
+    def __len__(self):
+        return int(self._alive.sum()) + len(self._delta)
+
+    def _idf_squared(self):
+        count = len(self)
+        idf = np.log((1.0 + count) / (1.0 + self._df)) + 1.0
+        return (idf * idf).astype(np.float32)
+
+    def most_similar(self, recipe_id, k=10):
+        """Return up to k (recipe_id, cosine similarity) pairs, best first."""
+        with self._lock:
+            if recipe_id in self._delta:
+                columns = np.fromiter(self._delta[recipe_id], dtype=np.int64)
+            else:
+                position = self._position(recipe_id)
+                if position is None or not self._alive[position]:
+                    return []
+                columns = self._base.indices[self._base.indptr[position]:self._base.indptr[position + 1]]
+            if not len(columns):
+                return []
+            weights = self._idf_squared()
+            query = np.zeros(N_FEATURES, dtype=np.float32)
+            query[columns] = weights[columns]
+            if self._delta_matrix is None:
+                self._delta_matrix = (np.array(list(self._delta), dtype=np.int64),
+                                      _rows_to_csr(list(self._delta.values())))
+            delta_ids, delta = self._delta_matrix
+            if self._norms is None:
+                # Features are binary, so a row's squared TF-IDF norm is the
+                # sum of its columns' squared IDF.
+                self._norms = (np.sqrt(self._base @ weights), np.sqrt(delta @ weights))
+            base_norms, delta_norms = self._norms
+            scores = np.concatenate([self._base @ query, delta @ query])
+            norms = np.concatenate([base_norms, delta_norms])
+            ids = np.concatenate([self._base_ids, delta_ids])
+            alive = np.concatenate([self._alive, np.ones(len(delta_ids), dtype=bool)])
+        query_norm = np.sqrt(weights[columns].sum())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = scores / (norms * query_norm)
+        scores[~alive | (ids == recipe_id) | ~np.isfinite(scores)] = 0.0
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index():
+    """Return the SimilarityIndex for db.DB_FILE, loading or building it on first use.
+
+    The index is synced with the database when opened and then follows
+    saves and deletes through db's change listeners.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db.DB_FILE)
+        if index is None:
+            index = SimilarityIndex(db.DB_FILE + ".similar")
+            if index.load():
+                index.sync()
+            else:
+                index.rebuild()
+            db.add_change_listener(index.on_change)
+            _indexes[db.DB_FILE] = index
+        return index
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recipe_id", type=int, nargs="?")
+    parser.add_argument("--db", default=db.DB_FILE,
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    parser.add_argument("-k", type=int, default=10, help="number of recipes to return")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index from scratch")
+    args = parser.parse_args(argv)
+
+    db.DB_FILE = args.db
+    db.init_db()
+    if args.rebuild:
+        index = SimilarityIndex(db.DB_FILE + ".similar")
+        index.rebuild()
+        print(f"indexed {len(index)} recipes", file=sys.stderr)
+    else:
+        index = get_index()
+    if args.recipe_id is not None:
+        for recipe_id, score in index.most_similar(args.recipe_id, args.k):
+            with db.get_connections().read() as conn:
+                (name,) = conn.execute("SELECT name FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+            print(f"{recipe_id:>8}  {score:.3f}  {name}")
+    db.close_db()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""The vectorized MinHash arithmetic must match plain integer arithmetic.
+
+Signatures are stored in the database, so any drift would silently stop
+new recipes matching the ones saved before.
+"""
+import random
+
+import numpy as np
+
+import minhash
+
+WORDS = ["salt", "pepper", "onion", "garlic", "tomato", "basil", "chicken", "rice",
+         "stir", "bake", "simmer", "chop", "until", "golden", "minutes", "serve"]
+
+def reference_signature(ingredients, recipe_text):
+    hashes = [minhash._hash(feature) for feature in minhash.shingles(ingredients, recipe_text)]
+    if not hashes:
+        return None
+    return [min((a * h + b) % minhash._PRIME for h in hashes) for a, b in minhash._PERMUTATIONS]
+
+def random_recipe(rng):
+    ingredients = ", ".join(rng.sample(WORDS, rng.randrange(0, 6)))
+    text = " ".join(rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(rng.randrange(0, 40)))
+    return ingredients, text
+
+def test_signatures_match_scalar_reference(monkeypatch):
+    rng = random.Random(2024)
+    recipes = [random_recipe(rng) for _ in range(300)]
+    # Empty recipes have no signature and must not shift their neighbours'.
+    for position in (0, 57, 58, 299):
+        recipes[position] = ("", "")
+    # Small passes make recipes straddle several NumPy batches.
+    monkeypatch.setattr(minhash, "_BATCH_HASHES", 64)
+    signatures = list(minhash.signatures(recipes))
+    assert len(signatures) == len(recipes)
+    for recipe, signature in zip(recipes, signatures):
+        assert signature == reference_signature(*recipe)
+    assert signatures[57] is None and signatures[299] is None
+
+def test_modular_product_at_extremes():
+    # Feature hashes just below the prime exercise every carry in the split product.
+    hashes = [minhash._PRIME - 1, minhash._PRIME - 2, (1 << 32) - 1, 1 << 32, 1, 0]
+    values = minhash._permute(np, hashes).tolist()
+    for (a, b), row in zip(minhash._PERMUTATIONS, values):
+        assert row == [(a * h + b) % minhash._PRIME for h in hashes]
+
+def test_single_signature_and_empty_recipe():
+    assert minhash.signature("", "") is None
+    assert minhash.signature("2 eggs, salt", "whisk and fry") == reference_signature("2 eggs, salt", "whisk and fry")
+
+def test_similarities_match_pairwise_similarity():
+    rng = random.Random(7)
+    sig = minhash.signature(*random_recipe(rng)) or minhash.signature("salt", "")
+    others = [minhash.signature(*random_recipe(rng)) for _ in range(50)]
+    others = [other for other in others if other is not None] + [sig]
+    scores = minhash.similarities(sig, [minhash.pack(other) for other in others])
+    assert scores.tolist() == [minhash.similarity(sig, other) for other in others]
+    assert scores[-1] == 1.0
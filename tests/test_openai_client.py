@@ -0,0 +1,174 @@
+"""Coalescing of identical in-flight calls in OpenAIClient.call()."""
+import threading
+import time
+
+import pytest
+
+from openai_client import OpenAIClient
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for condition")
+        time.sleep(0.005)
+
+class Caller(threading.Thread):
+    """Make one client.call() on its own thread and keep its outcome."""
+
+    def __init__(self, client, key, send, should_stop=None):
+        super().__init__(daemon=True)
+        self.client = client
+        self.key = key
+        self.send = send
+        self.should_stop = should_stop
+        self.deltas = []
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.client.call(self.key, self.send, self.deltas.append, self.should_stop)
+        except Exception as e:
+            self.error = e
+
+def test_identical_concurrent_calls_share_one_send():
+    client = OpenAIClient()
+    release = threading.Event()
+    sends = []
+
+    def send(on_delta, should_stop):
+        sends.append(1)
+        release.wait(5)
+        return "recipe"
+
+    callers = [Caller(client, "same", send) for _ in range(5)]
+    for caller in callers:
+        caller.start()
+    wait_until(lambda: client.coalesced == 4)
+    release.set()
+    for caller in callers:
+        caller.join(5)
+    assert len(sends) == 1
+    assert [caller.result for caller in callers] == ["recipe"] * 5
+    # The key is free again once the call finishes.
+    assert client.call("same", lambda on_delta, should_stop: "again") == "again"
+    assert len(sends) == 1
+
+def test_different_keys_are_not_coalesced():
+    client = OpenAIClient()
+    assert client.call("a", lambda on_delta, should_stop: 1) == 1
+    assert client.call("b", lambda on_delta, should_stop: 2) == 2
+    assert client.coalesced == 0
+
+def test_followers_reraise_the_leaders_error():
+    client = OpenAIClient()
+    release = threading.Event()
+    failure = ValueError("upstream failed")
+
+    def send(on_delta, should_stop):
+        release.wait(5)
+        raise failure
+
+    callers = [Caller(client, "same", send) for _ in range(3)]
+    for caller in callers:
+        caller.start()
+    wait_until(lambda: client.coalesced == 2)
+    release.set()
+    for caller in callers:
+        caller.join(5)
+    assert all(caller.error is failure for caller in callers)
+    assert client.stats()["errors"] == 3
+
+def test_late_joiner_gets_streamed_text_first():
+    client = OpenAIClient()
+    first_sent = threading.Event()
+    release = threading.Event()
+
+    def send(on_delta, should_stop):
+        on_delta("ab")
+        on_delta("cd")
+        first_sent.set()
+        release.wait(5)
+        on_delta("ef")
+        return "abcdef"
+
+    leader = Caller(client, "stream", send)
+    leader.start()
+    first_sent.wait(5)
+    late = Caller(client, "stream", send)
+    late.start()
+    wait_until(lambda: client.coalesced == 1)
+    release.set()
+    leader.join(5)
+    late.join(5)
+    assert leader.deltas == ["ab", "cd", "ef"]
+    # Everything streamed before joining arrives as one replay, then the rest.
+    assert late.deltas == ["abcd", "ef"]
+    assert late.result == leader.result == "abcdef"
+
+def test_shared_stream_stops_only_when_every_caller_stops():
+    client = OpenAIClient()
+    stop_a = threading.Event()
+    stop_b = threading.Event()
+    chunks_after_a_stopped = []
+
+    def send(on_delta, should_stop):
+        while not should_stop():
+            on_delta(".")
+            if stop_a.is_set():
+                chunks_after_a_stopped.append(1)
+            time.sleep(0.005)
+        return "stopped"
+
+    a = Caller(client, "stream", send, stop_a.is_set)
+    a.start()
+    wait_until(lambda: a.deltas)
+    b = Caller(client, "stream", send, stop_b.is_set)
+    b.start()
+    wait_until(lambda: client.coalesced == 1)
+    stop_a.set()
+    # One caller stopping is not enough; the stream keeps going for the other.
+    wait_until(lambda: len(chunks_after_a_stopped) >= 5)
+    assert a.is_alive() and b.is_alive()
+    stop_b.set()
+    a.join(5)
+    b.join(5)
+    assert a.result == b.result == "stopped"
+
+def test_uncoalesced_calls_each_send():
+    client = OpenAIClient()
+    sends = []
+
+    def send(on_delta, should_stop):
+        sends.append(1)
+        return len(sends)
+
+    assert client.call("same", send, coalesce=False) == 1
+    assert client.call("same", send, coalesce=False) == 2
+
+@pytest.mark.parametrize("max_concurrency", [1, 2])
+def test_concurrency_is_capped(max_concurrency):
+    client = OpenAIClient(max_concurrency=max_concurrency)
+    running = []
+    peak = []
+    release = threading.Event()
+    lock = threading.Lock()
+
+    def send(on_delta, should_stop):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        release.wait(5)
+        with lock:
+            running.pop()
+        return None
+
+    callers = [Caller(client, f"key-{i}", send) for i in range(4)]
+    for caller in callers:
+        caller.start()
+    wait_until(lambda: len(running) == max_concurrency and client.waiting == 4 - max_concurrency)
+    release.set()
+    for caller in callers:
+        caller.join(5)
+    assert max(peak) == max_concurrency
@@ -0,0 +1,64 @@
+"""Guard the Recipe Book queries against plan regressions on a 100k-row book."""
+import pytest
+
+import db
+
+ROWS = 100_000
+
+# (filters, index) for list queries that must be answered from a covering
+# index in index order: no table scan and no temporary sort.
+COVERING_SHAPES = [
+    ({"order_by": "name"}, "idx_recipes_name"),
+    ({"order_by": "calories"}, "idx_recipes_calories"),
+    ({"order_by": "calories_desc"}, "idx_recipes_calories"),
+    ({"min_cal": 300, "max_cal": 400, "order_by": "calories"}, "idx_recipes_calories"),
+    ({"min_cal": 300, "max_cal": 400, "order_by": "calories_desc"}, "idx_recipes_calories"),
+    ({"max_cal": 600, "order_by": "name"}, "idx_recipes_name"),
+]
+
+@pytest.fixture(scope="module")
+def book(tmp_path_factory):
+    previous = db.DB_FILE
+    db.DB_FILE = str(tmp_path_factory.mktemp("plans") / "recipes.db")
+    db.init_db()
+    with db.get_connections().write() as conn:
+        conn.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) "
+            "INSERT INTO recipes (name, ingredients, recipe_text, calories) "
+            "SELECT 'Recipe ' || i, 'chicken, rice', 'Cook step ' || i, 100 + (i * 37) % 1200 FROM n",
+            (ROWS,))
+        conn.execute("ANALYZE")
+    yield
+    db.close_db()
+    db.DB_FILE = previous
+
+def _plan(**filters):
+    query, params = db._recipe_query(("id", "name", "calories"), **filters)
+    with db.get_connections().read() as conn:
+        return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+def _scans_table(plan):
+    return any(step.split()[:2] in (["SCAN", "recipes"], ["SCAN", "r"]) and "COVERING INDEX" not in step
+               for step in plan)
+
+@pytest.mark.parametrize("filters, index", COVERING_SHAPES)
+def test_list_queries_use_covering_index(book, filters, index):
+    plan = _plan(**filters)
+    assert any(f"USING COVERING INDEX {index}" in step for step in plan), plan
+    assert not any("USE TEMP B-TREE" in step for step in plan), plan
+    assert not _scans_table(plan), plan
+
+def test_calorie_range_searches_index(book):
+    # ID order can't come from the calories index, so only the (small)
+    # matching range is sorted; the table itself must not be scanned.
+    plan = _plan(min_cal=300, max_cal=400)
+    assert any(step.startswith("SEARCH recipes USING COVERING INDEX idx_recipes_calories")
+               for step in plan), plan
+    assert not _scans_table(plan), plan
+
+def test_text_search_uses_fts(book):
+    if not db._fts5_available:
+        pytest.skip("SQLite was built without FTS5")
+    plan = _plan(search_text="chicken")
+    assert any("VIRTUAL TABLE INDEX" in step for step in plan), plan
+    assert not _scans_table(plan), plan
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Export a recipe book to JSON Lines, or import one, in constant memory.
+
+Each line holds one recipe: {"id", "name", "ingredients", "recipe_text",
+"calories"}. Files ending in .gz are gzip-compressed, and "-" means
+stdin/stdout. Export streams rows with fetchmany from a single read
+snapshot. Import parses lines lazily and saves them in batches, one
+transaction per batch, so neither side holds the book in memory.
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import sys
+import time
+
+import db
+
+DUPLICATE_MODES = ("skip", "keep")
+
+def _open(path, mode):
+    if path == "-":
+        # Leave stdin/stdout open when the with block ends.
+        return contextlib.nullcontext(sys.stdout if "w" in mode else sys.stdin)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+class Progress:
+    """Print a running count and rate to stderr every `every` rows."""
+
+    def __init__(self, verb, every):
+        self.verb = verb
+        self.every = every
+        self.started = time.perf_counter()
+        self.reported = 0
+
+    def update(self, count, extra=""):
+        if self.every and count - self.reported >= self.every:
+            self.reported = count
+            self.report(count, extra)
+
+    def report(self, count, extra=""):
+        rate = count / max(time.perf_counter() - self.started, 1e-9)
+        print(f"{self.verb} {count} recipes ({rate:.0f}/s){extra}", file=sys.stderr)
+
+def export_recipes(path, batch_size=1000, progress_every=10000):
+    """Write every recipe to path as JSON Lines and return how many were written."""
+    progress = Progress("exported", progress_every)
+    count = 0
+    with _open(path, "w") as f:
+        for recipe_id, name, ingredients, recipe_text, calories in db.iter_recipes(batch_size):
+            f.write(json.dumps({"id": recipe_id, "name": name, "ingredients": ingredients,
+                                "recipe_text": recipe_text, "calories": calories},
+                               ensure_ascii=False))
+            f.write("\n")
+            count += 1
+            progress.update(count)
+    progress.report(count)
+    return count
+
+def _text(data, key, default):
+    """Return data[key] if it is a string, default if it is missing or null."""
+    value = data.get(key)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise TypeError(f"{key} must be a string, not {type(value).__name__}")
+    return value or default
+
+def _read_recipes(f, counts):
+    """Yield (name, ingredients, recipe_text, calories) from JSON Lines, skipping bad lines.
+
+    A line is invalid unless it is a JSON object whose name, ingredients and
+    recipe_text are strings or null and whose calories is null or converts
+    to an integer.
+    """
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise TypeError(f"expected an object, not {type(data).__name__}")
+            calories = data.get("calories")
+            if isinstance(calories, bool):
+                raise TypeError("calories must be a number, not bool")
+            recipe = (_text(data, "name", "Unnamed Recipe"), _text(data, "ingredients", ""),
+                      _text(data, "recipe_text", ""), int(calories) if calories is not None else 0)
+        except (ValueError, TypeError, OverflowError) as e:
+            counts["invalid"] += 1
+            print(f"line {line_number}: skipped ({e})", file=sys.stderr)
+        else:
+            yield recipe
+
+def import_recipes(path, duplicates="skip", batch_size=1000, progress_every=10000):
+    """Save the recipes in a JSON Lines file and return counts of what happened.
+
+    With duplicates="skip", recipes whose name, ingredients and text exactly
+    match a saved recipe (or an earlier one in the same batch) are skipped.
+    "keep" imports everything; near-duplicates are flagged as usual either way.
+    """
+    if duplicates not in DUPLICATE_MODES:
+        raise ValueError(f"unknown duplicate mode: {duplicates!r}")
+    counts = {"imported": 0, "duplicates": 0, "invalid": 0}
+    progress = Progress("imported", progress_every)
+    batch = []
+    seen = set()
+
+    def flush():
+        if batch:
+            counts["imported"] += db.save_recipes(batch)
+            batch.clear()
+            seen.clear()
+            progress.update(counts["imported"], f", {counts['duplicates']} duplicates skipped")
+
+    with _open(path, "r") as f:
+        for recipe in _read_recipes(f, counts):
+            if duplicates == "skip":
+                key = recipe[:3]
+                if key in seen or db.recipe_exists(*key):
+                    counts["duplicates"] += 1
+                    continue
+                seen.add(key)
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    progress.report(counts["imported"], f", {counts['duplicates']} duplicates skipped")
+    return counts
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default=db.DB_FILE,
+                        help="recipe database (default: $RECIPE_DB or recipes.db)")
+    common.add_argument("--batch-size", type=int, default=1000, help="rows per fetch or transaction")
+    common.add_argument("--progress-every", type=int, default=10000,
+                        help="report progress every N recipes (0 for only a summary)")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", parents=[common],
+                                        help="write the book to a .jsonl or .jsonl.gz file")
+    export_parser.add_argument("path", help='output file, or "-" for stdout')
+    import_parser = commands.add_parser("import", parents=[common],
+                                        help="add the recipes from a .jsonl or .jsonl.gz file")
+    import_parser.add_argument("path", help='input file, or "-" for stdin')
+    import_parser.add_argument("--duplicates", choices=DUPLICATE_MODES, default="skip",
+                               help="skip exact duplicates of saved recipes, or keep them")
+    args = parser.parse_args(argv)
+
+    db.DB_FILE = args.db
+    db.init_db()
+    try:
+        if args.command == "export":
+            export_recipes(args.path, args.batch_size, args.progress_every)
+        else:
+            counts = import_recipes(args.path, args.duplicates, args.batch_size, args.progress_every)
+            if counts["invalid"]:
+                print(f"{counts['invalid']} invalid lines skipped", file=sys.stderr)
+    finally:
+        db.close_db()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,164 @@
 import re
+import unicodedata
+
+# Units and sizes stripped from ingredient strings before indexing them.
+UNIT_WORDS = {
+    "cup", "cups", "c", "tablespoon", "tablespoons", "tbsp", "tbs", "tb",
+    "teaspoon", "teaspoons", "tsp", "ts", "ounce", "ounces", "oz", "fl",
+    "pound", "pounds", "lb", "lbs", "gram", "grams", "g", "kilogram",
+    "kilograms", "kg", "milliliter", "milliliters", "millilitre", "millilitres",
+    "ml", "liter", "liters", "litre", "litres", "l", "pinch", "pinches",
+    "dash", "dashes", "clove", "cloves", "can", "cans", "package", "packages",
+    "pkg", "slice", "slices", "piece", "pieces", "bunch", "bunches", "sprig",
+    "sprigs", "stick", "sticks", "quart", "quarts", "qt", "pint", "pints", "pt",
+    "handful", "large", "medium", "small", "of",
+}
+
+# Preparation words that do not change what the ingredient is.
+PREP_WORDS = {
+    "chopped", "diced", "minced", "sliced", "grated", "shredded", "crushed",
+    "fresh", "freshly", "ground", "peeled", "finely", "roughly", "thinly",
+    "to", "taste", "optional", "and", "or",
+}
+
+_QUANTITY_RE = re.compile(r"^[\d\s/.\-¼-¾⅐-⅞]+")
+
+def split_ingredients(ingredients):
+    """Split a comma-separated ingredient string into stripped, non-empty items."""
+    return [item.strip() for item in (ingredients or "").split(",") if item.strip()]
+
+def _singular(word):
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("oes") and len(word) > 4:
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+def normalize_ingredient(item):
+    """Reduce an ingredient line such as "2 cups chopped tomatoes" to "tomato".
+
+    Quantities, units, parenthetical notes and preparation words are removed
+    and words are singularized, so the same ingredient written differently
+    in different recipes maps to one name. Returns "" if nothing is left.
+    """
+    text = re.sub(r"\([^)]*\)", " ", item.lower())
+    text = _QUANTITY_RE.sub(" ", text)
+    words = re.findall(r"[a-z][a-z'\-]*", text)
+    # Units only count while they lead the phrase ("2 cans of beans").
+    while words and words[0] in UNIT_WORDS:
+        words.pop(0)
+    words = [_singular(word) for word in words if word not in PREP_WORDS]
+    return " ".join(words)
+
+# Units a shopping list can add up: each spelling maps to a canonical unit
+# and how many of it one of the spelled unit is. Volumes are kept in ml and
+# weights in g; anything else is counted in its own unit.
+UNIT_CONVERSIONS = {
+    "ml": ("ml", 1), "milliliter": ("ml", 1), "milliliters": ("ml", 1),
+    "millilitre": ("ml", 1), "millilitres": ("ml", 1),
+    "l": ("ml", 1000), "liter": ("ml", 1000), "liters": ("ml", 1000),
+    "litre": ("ml", 1000), "litres": ("ml", 1000),
+    "tsp": ("ml", 4.92892), "ts": ("ml", 4.92892), "teaspoon": ("ml", 4.92892),
+    "teaspoons": ("ml", 4.92892),
+    "tbsp": ("ml", 14.7868), "tbs": ("ml", 14.7868), "tb": ("ml", 14.7868),
+    "tablespoon": ("ml", 14.7868), "tablespoons": ("ml", 14.7868),
+    "c": ("ml", 236.588), "cup": ("ml", 236.588), "cups": ("ml", 236.588),
+    "fl oz": ("ml", 29.5735),
+    "pt": ("ml", 473.176), "pint": ("ml", 473.176), "pints": ("ml", 473.176),
+    "qt": ("ml", 946.353), "quart": ("ml", 946.353), "quarts": ("ml", 946.353),
+    "g": ("g", 1), "gram": ("g", 1), "grams": ("g", 1),
+    "kg": ("g", 1000), "kilogram": ("g", 1000), "kilograms": ("g", 1000),
+    "oz": ("g", 28.3495), "ounce": ("g", 28.3495), "ounces": ("g", 28.3495),
+    "lb": ("g", 453.592), "lbs": ("g", 453.592), "pound": ("g", 453.592),
+    "pounds": ("g", 453.592),
+    "pinch": ("pinch", 1), "pinches": ("pinch", 1), "dash": ("dash", 1), "dashes": ("dash", 1),
+    "clove": ("clove", 1), "cloves": ("clove", 1), "can": ("can", 1), "cans": ("can", 1),
+    "package": ("package", 1), "packages": ("package", 1), "pkg": ("package", 1),
+    "slice": ("slice", 1), "slices": ("slice", 1), "piece": ("piece", 1), "pieces": ("piece", 1),
+    "bunch": ("bunch", 1), "bunches": ("bunch", 1), "sprig": ("sprig", 1), "sprigs": ("sprig", 1),
+    "stick": ("stick", 1), "sticks": ("stick", 1), "handful": ("handful", 1),
+}
+
+# Units a canonical amount is shown in, largest first, with the smallest
+# amount of each worth showing in it.
+DISPLAY_UNITS = {
+    "ml": [("cup", 236.588, 0.25), ("tbsp", 14.7868, 1), ("tsp", 4.92892, 0)],
+    "g": [("kg", 1000, 1), ("g", 1, 0)],
+}
+
+_NUMBER = r"\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?(?:\s*[¼-¾⅐-⅞])?|[¼-¾⅐-⅞]"
+_AMOUNT_RE = re.compile(rf"^\s*({_NUMBER})(?:\s*(?:-|–|to)\s*({_NUMBER}))?\s*")
+
+def _parse_number(text):
+    total = 0.0
+    for part in re.findall(r"\d+/\d+|\d+(?:\.\d+)?|[¼-¾⅐-⅞]", text):
+        if "/" in part:
+            numerator, denominator = part.split("/")
+            total += int(numerator) / int(denominator) if int(denominator) else 0
+        elif part.isascii():
+            total += float(part)
+        else:
+            total += unicodedata.numeric(part)
+    return total
+
+def parse_ingredient(item):
+    """Split an ingredient line such as "1 1/2 cups chopped tomatoes" into (quantity, unit, name).
+
+    The quantity is converted to the unit's canonical unit (ml, g or a
+    counted unit such as "clove"), so (1.5 cups) becomes (354.9, "ml").
+    A bare count ("2 eggs") has unit "", and a line without a quantity
+    ("salt to taste") has quantity None. A range ("2-3") counts as its
+    upper end. The name is normalized as in normalize_ingredient.
+    """
+    text = re.sub(r"\([^)]*\)", " ", item.lower())
+    match = _AMOUNT_RE.match(text)
+    if not match:
+        return None, "", normalize_ingredient(item)
+    quantity = _parse_number(match.group(2) or match.group(1))
+    words = text[match.end():].replace(".", " ").split()
+    unit, factor = "", 1
+    for size in (2, 1):
+        spelled = " ".join(words[:size])
+        if len(words) >= size and spelled in UNIT_CONVERSIONS:
+            unit, factor = UNIT_CONVERSIONS[spelled]
+            words = words[size:]
+            break
+    return quantity * factor, unit, normalize_ingredient(" ".join(words))
+
+def _format_number(value):
+    if value >= 10:
+        return str(round(value))
+    whole = int(value)
+    fraction = value - whole
+    for denominator in (2, 3, 4):
+        numerator = round(fraction * denominator)
+        if 0 < numerator < denominator and abs(fraction - numerator / denominator) < 0.02:
+            return f"{whole} {numerator}/{denominator}" if whole else f"{numerator}/{denominator}"
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+def format_amount(quantity, unit):
+    """Render a canonical quantity and unit for people, e.g. (354.9, "ml") -> "1 1/2 cups"."""
+    if quantity is None:
+        return ""
+    if unit in DISPLAY_UNITS:
+        for name, size, minimum in DISPLAY_UNITS[unit]:
+            if quantity / size >= minimum:
+                amount = quantity / size
+                unit = name + ("s" if name == "cup" and amount > 1 else "")
+                return f"{_format_number(amount)} {unit}"
+    if unit and quantity > 1:
+        unit += "es" if unit.endswith(("ch", "sh")) else "s"
+    return f"{_format_number(quantity)} {unit}".strip()
+
+def format_shopping_list(items):
+    """Return a shopping list, one line per (name, quantity, unit) item."""
+    lines = []
+    for name, quantity, unit in items:
+        amount = format_amount(quantity, unit)
+        lines.append(f"- {amount} {name}" if amount else f"- {name}")
+    return "\n".join(lines)
 
 def format_recipe(recipe_data):
     """Return a formatted recipe string given the recipe JSON data."""
@@ -18,3 +178,16 @@ def format_recipe(recipe_data):
         "Instructions:\n" + formatted_instructions
     )
     return formatted_text
+
+def parse_calorie_range(text):
+    """Parse "600" (maximum) or "300-600" (range) into (min_cal, max_cal).
+
+    Either bound may be None; unparseable input means no calorie filter.
+    """
+    low, sep, high = text.strip().partition("-")
+    try:
+        if sep:
+            return (int(low) if low.strip() else None, int(high) if high.strip() else None)
+        return None, int(low) if low.strip() else None
+    except ValueError:
+        return None, None